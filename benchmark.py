@@ -0,0 +1,401 @@
+#
+# FIT VUT 2023 - IPP Project Implemenation part 2
+# Benchmarks of the interpret of IPPcode23 language
+#
+# File: benchmark.py
+# Author(s): xpauli08
+#
+
+# Generates the XML programs of the workloads and measures them. The load
+# time and the run time are measured in this process by the Interpreter
+# class of interpret.py, the number of instructions by a run with
+# --profile and the peak memory by a separate run of interpret.py. The
+# results can be saved as a baseline and compared with it later.
+
+import sys
+import os
+import argparse
+import json
+import time
+import subprocess
+import tempfile
+from xml.sax.saxutils import escape
+
+import interpret
+
+INTERPRET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'interpret.py')
+
+# Exit code when a result is worse than the baseline
+ERR_REGRESSION = 1
+
+# Number of loads of the program for each run, unless they take longer
+# than the time in seconds
+load_repeats = 20
+load_time_limit = 2.0
+
+# The load time is only worse than the baseline if it's longer by more
+# than the tolerance and by at least this many seconds
+load_min_difference = 0.002
+
+# Instructions with a label as their first operand
+label_opcodes = ('LABEL', 'JUMP', 'CALL', 'JUMPIFEQ', 'JUMPIFNEQ', 'JUMPIFEQS', 'JUMPIFNEQS')
+
+################################ WORKLOADS ##################################
+
+# Each workload gets the size of the benchmark and returns the IPPcode23
+# source and the input of the program. With the size 1, each of them runs
+# about a few hundred thousand instructions, except the functions, whose
+# program grows with the size, so that it measures mainly the load.
+
+# Counting loop with ADD, SUB and JUMPIFNEQ
+def generate_loop(size):
+   count = 50000 * size
+   source = f'''
+      DEFVAR GF@i
+      DEFVAR GF@s
+      MOVE GF@i int@0
+      MOVE GF@s int@0
+      LABEL loop
+      ADD GF@s GF@s GF@i
+      SUB GF@s GF@s int@1
+      ADD GF@i GF@i int@1
+      JUMPIFNEQ loop GF@i int@{count}
+      WRITE GF@s
+   '''
+   return source, ''
+
+# Recursive CALL and RETURN, each call has it's own frame
+def generate_recursion(size):
+   depth = 50
+   repeats = 200 * size
+   source = f'''
+      DEFVAR GF@r
+      DEFVAR GF@k
+      MOVE GF@r int@0
+      MOVE GF@k int@0
+      LABEL again
+      CREATEFRAME
+      DEFVAR TF@n
+      MOVE TF@n int@{depth}
+      CALL sum
+      ADD GF@k GF@k int@1
+      JUMPIFNEQ again GF@k int@{repeats}
+      WRITE GF@r
+      EXIT int@0
+      LABEL sum
+      PUSHFRAME
+      JUMPIFEQ base LF@n int@0
+      DEFVAR LF@m
+      SUB LF@m LF@n int@1
+      CREATEFRAME
+      DEFVAR TF@n
+      MOVE TF@n LF@m
+      CALL sum
+      ADD GF@r GF@r LF@n
+      LABEL base
+      POPFRAME
+      RETURN
+   '''
+   return source, ''
+
+# String built by CONCAT, then changed by GETCHAR and SETCHAR
+def generate_strings(size):
+   count = 20000 * size
+   source = f'''
+      DEFVAR GF@s
+      DEFVAR GF@i
+      DEFVAR GF@j
+      DEFVAR GF@c
+      DEFVAR GF@n
+      MOVE GF@s string@
+      MOVE GF@i int@0
+      LABEL build
+      CONCAT GF@s GF@s string@abc
+      ADD GF@i GF@i int@1
+      JUMPIFNEQ build GF@i int@{count}
+      STRLEN GF@n GF@s
+      SUB GF@n GF@n int@1
+      MOVE GF@i int@0
+      LABEL edit
+      ADD GF@j GF@i int@1
+      GETCHAR GF@c GF@s GF@j
+      SETCHAR GF@s GF@i GF@c
+      MOVE GF@i GF@j
+      JUMPIFNEQ edit GF@i GF@n
+      STRLEN GF@n GF@s
+      WRITE GF@n
+   '''
+   return source, ''
+
+# READ of an integer and a string in each iteration
+def generate_read(size):
+   count = 30000 * size
+   source = f'''
+      DEFVAR GF@i
+      DEFVAR GF@a
+      DEFVAR GF@b
+      DEFVAR GF@s
+      MOVE GF@i int@0
+      MOVE GF@s int@0
+      LABEL loop
+      READ GF@a int
+      READ GF@b string
+      ADD GF@s GF@s GF@a
+      ADD GF@i GF@i int@1
+      JUMPIFNEQ loop GF@i int@{count}
+      WRITE GF@s
+   '''
+   program_input = ''.join(f'{i}\nline {i}\n' for i in range(count))
+   return source, program_input
+
+# WRITE of an integer and a string in each iteration
+def generate_write(size):
+   count = 50000 * size
+   source = f'''
+      DEFVAR GF@i
+      MOVE GF@i int@0
+      LABEL loop
+      WRITE GF@i
+      WRITE string@\\032line\\010
+      ADD GF@i GF@i int@1
+      JUMPIFNEQ loop GF@i int@{count}
+   '''
+   return source, ''
+
+# The loop of the stack instructions, ending by JUMPIFNEQS
+def generate_stack(size):
+   count = 25000 * size
+   source = f'''
+      DEFVAR GF@i
+      DEFVAR GF@s
+      MOVE GF@i int@0
+      MOVE GF@s int@0
+      LABEL loop
+      PUSHS GF@s
+      PUSHS GF@i
+      ADDS
+      PUSHS int@2
+      IDIVS
+      POPS GF@s
+      PUSHS GF@i
+      PUSHS int@1
+      ADDS
+      POPS GF@i
+      PUSHS GF@i
+      PUSHS int@{count}
+      JUMPIFNEQS loop
+      WRITE GF@s
+   '''
+   return source, ''
+
+# Many small functions, each called once, the program has about ten
+# thousand instructions with the size 1
+def generate_functions(size):
+   count = 1000 * size
+   lines = ['DEFVAR GF@s', 'MOVE GF@s int@0']
+   lines += [f'CALL f{number}' for number in range(count)]
+   lines += ['WRITE GF@s', 'EXIT int@0']
+
+   for number in range(count):
+      lines += [
+         f'LABEL f{number}',
+         'CREATEFRAME',
+         'PUSHFRAME',
+         'DEFVAR LF@x',
+         f'MOVE LF@x int@{number}',
+         'ADD GF@s GF@s LF@x',
+         f'JUMPIFEQ f{number}_end LF@x int@-1',
+         f'LABEL f{number}_end',
+         'POPFRAME',
+         'RETURN'
+      ]
+
+   return '\n'.join(lines), ''
+
+workloads = {
+   'loop': generate_loop,
+   'recursion': generate_recursion,
+   'strings': generate_strings,
+   'read': generate_read,
+   'write': generate_write,
+   'stack': generate_stack,
+   'functions': generate_functions
+}
+
+################################ FUNCTIONS ##################################
+
+# Translate the IPPcode23 source of a workload to the XML representation
+def generate_xml(source):
+   xml = ['<?xml version="1.0" encoding="UTF-8"?>', '<program language="IPPcode23">']
+
+   lines = [line.split() for line in source.splitlines() if line.strip()]
+   for order, (opcode, *operands) in enumerate(lines, 1):
+      xml.append(f' <instruction order="{order}" opcode="{opcode}">')
+
+      for number, operand in enumerate(operands, 1):
+         if number == 1 and opcode in label_opcodes:
+            arg_type, value = 'label', operand
+         elif number == 2 and opcode == 'READ':
+            arg_type, value = 'type', operand
+         elif operand[:3] in ('GF@', 'LF@', 'TF@'):
+            arg_type, value = 'var', operand
+         else:
+            arg_type, value = operand.split('@', 1)
+
+         xml.append(f'  <arg{number} type="{arg_type}">{escape(value)}</arg{number}>')
+
+      xml.append(' </instruction>')
+
+   xml.append('</program>')
+   return '\n'.join(xml) + '\n'
+
+# Number of executed instructions, from the report of --profile
+def count_instructions(source_name, input_name):
+   result = subprocess.run([sys.executable, INTERPRET_PATH, '--source', source_name, '--input', input_name, '--profile'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+   first_line = result.stderr.split('\n')[0].split()
+   return int(first_line[1])
+
+# Peak resident memory of interpret.py in bytes, None if the system
+# does not report it
+def measure_peak_rss(source_name, input_name):
+   if not hasattr(os, 'wait4'):
+      return None
+
+   process = subprocess.Popen([sys.executable, INTERPRET_PATH, '--source', source_name, '--input', input_name],
+                              stdout=subprocess.DEVNULL)
+   pid, status, usage = os.wait4(process.pid, 0)
+   process.returncode = os.waitstatus_to_exitcode(status)
+
+   # Linux reports kilobytes, macOS bytes
+   if sys.platform == 'darwin':
+      return usage.ru_maxrss
+   return usage.ru_maxrss * 1024
+
+# Measure one workload, the times are the best of the repeats, the load
+# is repeated more times, because it's usually much shorter
+def run_workload(name, size, repeats, directory):
+   source, program_input = workloads[name](size)
+   xml = generate_xml(source)
+
+   source_name = os.path.join(directory, f'{name}.xml')
+   input_name = os.path.join(directory, f'{name}.in')
+   with open(source_name, 'w') as source_file:
+      source_file.write(xml)
+   with open(input_name, 'w') as input_file:
+      input_file.write(program_input)
+
+   load_time = None
+   load_start = time.perf_counter()
+   for repeat in range(repeats * load_repeats):
+      start = time.perf_counter()
+      program = interpret.Interpreter(xml)
+      elapsed = time.perf_counter() - start
+
+      if load_time is None or elapsed < load_time:
+         load_time = elapsed
+      if repeat + 1 >= repeats and start + elapsed - load_start > load_time_limit:
+         break
+
+   run_time = None
+   for repeat in range(repeats):
+      start = time.perf_counter()
+      program.run(program_input)
+      elapsed = time.perf_counter() - start
+
+      if run_time is None or elapsed < run_time:
+         run_time = elapsed
+
+   instructions = count_instructions(source_name, input_name)
+   return {
+      'instructions': instructions,
+      'load_time': load_time,
+      'run_time': run_time,
+      'instructions_per_second': instructions / run_time,
+      'peak_rss': measure_peak_rss(source_name, input_name)
+   }
+
+def format_rss(peak_rss):
+   return '-' if peak_rss is None else f'{peak_rss / (1024 * 1024):.1f}'
+
+# Write the results, with the change against the baseline if it's given,
+# returns the names of the worse workloads
+def write_report(results, baseline, tolerance):
+   report = [f"{'Workload':<12}{'Instructions':>14}{'Load ms':>10}{'Run ms':>10}{'Instr/s':>12}{'RSS MB':>9}"]
+   regressions = []
+
+   for name, result in results.items():
+      line = (f"{name:<12}{result['instructions']:>14}{result['load_time'] * 1000:>10.2f}{result['run_time'] * 1000:>10.2f}"
+              f"{result['instructions_per_second']:>12.0f}{format_rss(result['peak_rss']):>9}")
+
+      previous = baseline.get(name) if baseline is not None else None
+      if previous is not None:
+         speed = result['instructions_per_second'] / previous['instructions_per_second'] - 1
+         load = result['load_time'] / previous['load_time'] - 1
+         line += f'  speed {speed:+.1%}, load {load:+.1%}'
+
+         load_worse = load > tolerance and result['load_time'] - previous['load_time'] > load_min_difference
+         worse = speed < -tolerance or load_worse
+         if result['peak_rss'] is not None and previous['peak_rss'] is not None:
+            rss = result['peak_rss'] / previous['peak_rss'] - 1
+            line += f', RSS {rss:+.1%}'
+            worse = worse or rss > tolerance
+
+         if worse:
+            line += '  WORSE'
+            regressions.append(name)
+
+      report.append(line)
+
+   sys.stdout.write('\n'.join(report) + '\n')
+   return regressions
+
+################################## BODY #####################################
+
+def main():
+   parser = argparse.ArgumentParser(description='Benchmarks of the interpret of IPPcode23 language.')
+   parser.add_argument('--size', type=int, default=1, help='size of the generated programs, 1 by default')
+   parser.add_argument('--repeat', type=int, default=3, help='number of runs of each workload, the best time is used')
+   parser.add_argument('--workloads', type=str, default=','.join(workloads), help='comma separated names of the workloads, all by default')
+   parser.add_argument('--output', type=str, help='directory to keep the generated programs and their inputs in')
+   parser.add_argument('--baseline', type=str, help='file with the results to compare with')
+   parser.add_argument('--save', type=str, help='file to save the results into, as a new baseline')
+   parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative change against the baseline, 0.2 by default')
+   args = parser.parse_args()
+
+   names = args.workloads.split(',')
+   for name in names:
+      if name not in workloads:
+         parser.error(f'unknown workload {name}, the workloads are {", ".join(workloads)}')
+   if args.size < 1 or args.repeat < 1:
+      parser.error('--size and --repeat must be at least 1')
+
+   # The baseline is only comparable with the same size
+   baseline = None
+   if args.baseline is not None:
+      with open(args.baseline) as baseline_file:
+         baseline_data = json.load(baseline_file)
+      if baseline_data['size'] != args.size:
+         parser.error(f"the baseline was measured with --size {baseline_data['size']}")
+      baseline = baseline_data['results']
+
+   # The generated programs are only kept in the given directory
+   with tempfile.TemporaryDirectory() as directory:
+      if args.output is not None:
+         directory = args.output
+         os.makedirs(directory, exist_ok=True)
+
+      results = {name: run_workload(name, args.size, args.repeat, directory) for name in names}
+
+   regressions = write_report(results, baseline, args.tolerance)
+
+   if args.save is not None:
+      with open(args.save, 'w') as save_file:
+         json.dump({'version': interpret.INTERPRET_VERSION, 'size': args.size, 'results': results}, save_file, indent=3)
+         save_file.write('\n')
+
+   if regressions:
+      sys.exit(ERR_REGRESSION)
+
+if __name__ == '__main__':
+   main()
@@ -8,13 +8,39 @@
 
 import sys
 import argparse
-import xml.etree.ElementTree as ElementTree
+import xml.parsers.expat as expat
 import re
+import os
+import stat
+import io
+import hashlib
+import marshal
+from array import array
+import importlib.util
+import py_compile
+import threading
+import queue
+import codecs
+import mmap
+import locale
+import multiprocessing
+import contextlib
+import time
+import socket
+import signal
+import gc
+import asyncio
+
+# Version of the interpret, part of the program cache key
+INTERPRET_VERSION = '1.4'
 
 ERR_OK = 0
 ERR_PARAM = 10
 ERR_IN_FILE = 11
 ERR_OUT_FILE = 12
+ERR_HEADER = 21
+ERR_OPCODE = 22
+ERR_LEXICAL = 23
 ERR_XML_FORMAT = 31
 ERR_XML_STRUCT = 32
 ERR_SEMANTIC = 52
@@ -26,97 +52,209 @@ ERR_OPERAND_VALUE = 57
 ERR_STRING = 58
 ERR_INTERNAL = 99
 
-opcodes_and_args = [
-   ['MOVE', 2],
-   ['CREATEFRAME', 0],
-   ['PUSHFRAME', 0],
-   ['POPFRAME', 0],
-   ['DEFVAR', 1],
-   ['CALL', 1],
-   ['RETURN', 0],
-   ['PUSHS', 1],
-   ['POPS', 1],
-   ['ADD', 3],
-   ['SUB', 3],
-   ['MUL', 3],
-   ['IDIV', 3],
-   ['LT', 3],
-   ['GT', 3],
-   ['EQ', 3],
-   ['AND', 3],
-   ['OR', 3],
-   ['NOT', 2],
-   ['INT2CHAR', 2],
-   ['STRI2INT', 3],
-   ['READ', 2],
-   ['WRITE', 1],
-   ['CONCAT', 3],
-   ['STRLEN', 2],
-   ['GETCHAR', 3],
-   ['SETCHAR', 3],
-   ['TYPE', 2],
-   ['LABEL', 1],
-   ['JUMP', 1],
-   ['JUMPIFEQ', 3],
-   ['JUMPIFNEQ', 3],
-   ['EXIT', 1],
-   ['DPRINT', 1],
-   ['BREAK', 0],
-   ['CLEARS', 0],
-   ['ADDS', 0],
-   ['SUBS', 0],
-   ['MULS', 0],
-   ['IDIVS', 0],
-   ['LTS', 0],
-   ['GTS', 0],
-   ['EQS', 0],
-   ['ANDS', 0],
-   ['ORS', 0],
-   ['NOTS', 0],
-   ['INT2CHARS', 0],
-   ['STRI2INTS', 0],
-   ['JUMPIFEQS', 1],
-   ['JUMPIFNEQS', 1],
-   ['INT2FLOAT', 2],
-   ['FLOAT2INT', 2]
-]
-
-# List of all program instructions
-instructions = []
-
-# Frames
-global_frame = {}
+# Operands of each instruction
+opcode_operands = {
+   'MOVE': ('var', 'symb'),
+   'CREATEFRAME': (),
+   'PUSHFRAME': (),
+   'POPFRAME': (),
+   'DEFVAR': ('var',),
+   'CALL': ('label',),
+   'RETURN': (),
+   'PUSHS': ('symb',),
+   'POPS': ('var',),
+   'ADD': ('var', 'symb', 'symb'),
+   'SUB': ('var', 'symb', 'symb'),
+   'MUL': ('var', 'symb', 'symb'),
+   'IDIV': ('var', 'symb', 'symb'),
+   'LT': ('var', 'symb', 'symb'),
+   'GT': ('var', 'symb', 'symb'),
+   'EQ': ('var', 'symb', 'symb'),
+   'AND': ('var', 'symb', 'symb'),
+   'OR': ('var', 'symb', 'symb'),
+   'NOT': ('var', 'symb'),
+   'INT2CHAR': ('var', 'symb'),
+   'STRI2INT': ('var', 'symb', 'symb'),
+   'READ': ('var', 'type'),
+   'WRITE': ('symb',),
+   'CONCAT': ('var', 'symb', 'symb'),
+   'STRLEN': ('var', 'symb'),
+   'GETCHAR': ('var', 'symb', 'symb'),
+   'SETCHAR': ('var', 'symb', 'symb'),
+   'TYPE': ('var', 'symb'),
+   'LABEL': ('label',),
+   'JUMP': ('label',),
+   'JUMPIFEQ': ('label', 'symb', 'symb'),
+   'JUMPIFNEQ': ('label', 'symb', 'symb'),
+   'EXIT': ('symb',),
+   'DPRINT': ('symb',),
+   'BREAK': (),
+   'CLEARS': (),
+   'ADDS': (),
+   'SUBS': (),
+   'MULS': (),
+   'IDIVS': (),
+   'LTS': (),
+   'GTS': (),
+   'EQS': (),
+   'ANDS': (),
+   'ORS': (),
+   'NOTS': (),
+   'INT2CHARS': (),
+   'STRI2INTS': (),
+   'JUMPIFEQS': ('label',),
+   'JUMPIFNEQS': ('label',),
+   'INT2FLOAT': ('var', 'symb'),
+   'FLOAT2INT': ('var', 'symb')
+}
+
+# Numbers of the opcodes in the compact program
+opcode_names = list(opcode_operands)
+opcode_codes = {opcode: code for code, opcode in enumerate(opcode_names)}
+UNKNOWN_OPCODE = 255
+
+# Type of the value of each argument type in the data of a Program
+argument_value_types = {
+   'var': str,
+   'int': int,
+   'bool': bool,
+   'string': str,
+   'nil': type(None),
+   'float': float,
+   'label': str,
+   'type': str
+}
+
+# Argument types allowed for each operand kind
+operand_types = {
+   'var': ('var',),
+   'symb': ('int', 'bool', 'string', 'nil', 'float', 'var'),
+   'label': ('label',),
+   'type': ('type',)
+}
+
+# Exit code of an argument of a wrong kind, ERR_BAD_TYPE for the opcodes
+# which are not listed, WRITE reports it as a wrong XML structure
+operand_kind_errors = {
+   'WRITE': ERR_XML_STRUCT
+}
+
+# The program, an instance of the Program class
+instructions = None
+
+# Positions of all labels
+labels = {}
+
+# Input for the READ instruction, a LineCursor, MappedInput or InputStream
+input_file = None
+
+# Output of the WRITE instruction, an OutputWriter
+output = None
+
+# Runs the loaded program once, for each input of --inputs-from, it's
+# shared by the forked processes
+loaded_program = None
+
+# Frames, each frame is a pair of lists with the values and the types of
+# it's variables indexed by their slots. The type is None for undefined
+# variables and an empty string for variables without a value.
+global_frame = ([], [])
 local_frames = []
-temporary_frame = {}
-
-# Counter for the READ function
-read_line_number = 0
+temporary_frame = None
 
-# Bool for keeping track of temporary frame status
-tf_not_created = True
+# Number of slots of the local and temporary frames
+local_frame_size = 0
 
-# Stack and call stack
-stack = []
+# Data stack, the values and their types are kept in two lists,
+# and the call stack
+stack_values = []
+stack_types = []
 call_stack = []
 
 ################################# CLASSES ###################################
 
+class InterpretError(Exception):
+
+   # Error which ends the interpretation, the code is the exit code of
+   # interpret.py. When the program is run by the Interpreter class, the
+   # output is the output written before the error, otherwise None.
+
+   def __init__(self, message, code):
+      super().__init__(message)
+      self.code = code
+      self.output = None
+
+class ParameterError(InterpretError):
+   # Wrong arguments of interpret.py
+   pass
+
+class FileError(InterpretError):
+   # The source or input file cannot be opened or the output file written
+   pass
+
+class SourceError(InterpretError):
+   # Wrong XML format or structure, header, opcode or operands of the source
+   pass
+
+class SemanticError(InterpretError):
+   # Undefined label or a redefined label or variable
+   pass
+
+class RunError(InterpretError):
+   # Error of an instruction during the interpretation
+   pass
+
+class InternalError(InterpretError):
+   pass
+
+class TestTimeout(BaseException):
+   # A batch test ran longer than the --timeout, it's not an Exception,
+   # so that capture_exit() does not report it as an error of the program
+   pass
+
+# Type of the error raised for each exit code
+error_classes = {
+   ERR_PARAM: ParameterError,
+   ERR_IN_FILE: FileError,
+   ERR_OUT_FILE: FileError,
+   ERR_HEADER: SourceError,
+   ERR_OPCODE: SourceError,
+   ERR_LEXICAL: SourceError,
+   ERR_XML_FORMAT: SourceError,
+   ERR_XML_STRUCT: SourceError,
+   ERR_SEMANTIC: SemanticError,
+   ERR_BAD_TYPE: RunError,
+   ERR_VAR_MISSING: RunError,
+   ERR_FRAME_MISSING: RunError,
+   ERR_VALUE_MISSING: RunError,
+   ERR_OPERAND_VALUE: RunError,
+   ERR_STRING: RunError,
+   ERR_INTERNAL: InternalError
+}
+
+
+
 class Argument:
-  
-   def __init__(self, arg_tag: str, arg_type: str, value):
-      self.set_order(arg_tag)
+
+   __slots__ = ('_order', '_type', '_value', '_frame', '_name', '_slot', '_target')
+
+   def __init__(self, order: int, arg_type: str, value):
+      self.set_order(order)
       self.set_type(arg_type)
       self.set_value(value)
 
-   def set_order(self, arg_tag):
-      if arg_tag == "arg1":
-         self._order = 1
-      elif arg_tag == "arg2":
-         self._order = 2
-      elif arg_tag == "arg3":
-         self._order = 3
-      else:
-         print_error('Error: invalid instruction argument', ERR_XML_STRUCT)
+      # Frame and name of a variable, set by decode()
+      self._frame = None
+      self._name = None
+
+      # Slot of a variable in it's frame, set by assign_slots()
+      self._slot = None
+
+      # Position of the jump, set by link_labels()
+      self._target = None
+
+   def set_order(self, order):
+      self._order = order
 
    def set_type(self, arg_type):
       self._type = arg_type
@@ -133,169 +271,1510 @@ class Argument:
    def get_value(self):
       return self._value
 
-class Instruction:
+   def set_frame(self, frame):
+      self._frame = frame
 
-   def __init__(self, opcode: str, order: int):
-      self.set_opcode(opcode)
-      self.set_order(order)
-      self._args = []
+   def get_frame(self):
+      return self._frame
 
-   def set_opcode(self, opcode):
-      self._opcode = opcode
+   def set_name(self, name):
+      self._name = name
 
-   def set_order(self, order):
-      self._order = order
+   def get_name(self):
+      return self._name
 
-   def get_opcode(self):
-      return self._opcode.upper()
+   def set_slot(self, slot):
+      self._slot = slot
 
-   def get_order(self):
-      return self._order     
+   def get_slot(self):
+      return self._slot
 
-   def add_arg(self, arg_tag, arg_type, value):
-      self._args.append(Argument(arg_tag, arg_type, value))
+   def set_target(self, target):
+      self._target = target
 
-   # Used when I need to sort the arguments
-   def set_args(self, args):
-      self._args = args
+   def get_target(self):
+      return self._target
 
-   def get_args(self):
-      return self._args
-   
-class Variable:
+   # Decode the value once when the program is loaded, so that the
+   # interpretation does not need to parse any strings
+   def decode(self):
 
-   # Access to global variables
-   global global_frame
-   global local_frames
-   global temporary_frame
-   global tf_not_created
+      if self._type == 'var':
+         frame, separator, name = (self._value or '').partition('@')
+         if not separator or frame not in ('GF', 'LF', 'TF'):
+            print_error('Error: wrong variable value', ERR_XML_STRUCT)
+         self._frame = sys.intern(frame)
+         self._name = sys.intern(name)
 
-   def __init__(self, name, value, frame):
-      self._name = name
-      self._value = value
-      self._frame = frame
-      self._type = None
-   
-   def get_name(self):
-      return self._name
+      elif self._type == 'int':
+         try:
+            self._value = int(self._value)
+         except:
+            print_error('Error: wrong integer value', ERR_XML_STRUCT)
 
-   def get_value(self):
-      return self._value
-   
-   # DEFVAR
-   def create(self):
+      elif self._type == 'bool':
+         if self._value == 'true':
+            self._value = True
+         elif self._value == 'false':
+            self._value = False
+         else:
+            print_error('Error: wrong bool value', ERR_XML_STRUCT)
+
+      elif self._type == 'string':
+         if self._value == None:
+            self._value = ''
+         else:
+            self._value = replace_escape_sequences(self._value)
+
+      elif self._type == 'nil':
+         self._value = NIL
+
+class Program:
+
+   # Compact representation of the program. The opcodes are numbers in an
+   # array and each instruction has an index into a pool of the argument
+   # tuples, same arguments of different instructions share one tuple and
+   # one Argument object, which is then also decoded only once.
+
+   __slots__ = ('_opcodes', '_orders', '_operands', '_args_pool', '_args_index', '_arguments')
+
+   def __init__(self):
+      self._opcodes = array('B')
+      self._orders = []
+      self._operands = array('I')
+      self._args_pool = []
+      self._args_index = {}
+      self._arguments = {}
+
+   def __len__(self):
+      return len(self._opcodes)
+
+   # Add an instruction, the arguments are a tuple of the order,
+   # type and value of each argument
+   def add_instruction(self, opcode, order, args):
+      self._opcodes.append(opcode_codes.get(opcode.upper(), UNKNOWN_OPCODE))
+      self._orders.append(order)
+
+      index = self._args_index.get(args)
+      if index is None:
+         index = len(self._args_pool)
+         self._args_index[args] = index
+         self._args_pool.append(tuple(self.get_argument(*arg) for arg in args))
+
+      self._operands.append(index)
+
+   # Same arguments are represented by the same object
+   def get_argument(self, order, arg_type, value):
+      key = (order, arg_type, value)
+      arg = self._arguments.get(key)
+      if arg is None:
+         arg = Argument(order, arg_type, value)
+         self._arguments[key] = arg
+
+      return arg
+
+   # Opcode of the i-th instruction, None if it's not known
+   def get_opcode(self, i):
+      code = self._opcodes[i]
+      if code == UNKNOWN_OPCODE:
+         return None
+      return opcode_names[code]
+
+   def get_order(self, i):
+      return self._orders[i]
+
+   def get_args(self, i):
+      return self._args_pool[self._operands[i]]
+
+   # All different arguments of the program
+   def get_arguments(self):
+      return self._arguments.values()
+
+   def set_orders(self, orders):
+      # Orders too big for the array are kept in a list
+      try:
+         self._orders = array('q', orders)
+      except OverflowError:
+         self._orders = list(orders)
 
-      frame = self.get_frame()
+   # Sort the instructions by their order, which must be an integer
+   def sort(self):
 
-      # If variable already exists print an error
-      if self._name in frame:
-         print_error(f'Redefinition of variable: {self._name}', ERR_SEMANTIC)
-      
-      # Assing it's value and type to chosen frame
-      frame[self._name] = [self._value, self._type]
-   
-   # Assign value to the variable
-   def set(self):
+      try:
+         orders = [int(order) for order in self._orders]
+      except ValueError:
+         print_error('Error: string order', ERR_XML_STRUCT)
+
+      permutation = sorted(range(len(orders)), key=orders.__getitem__)
+      self._opcodes = array('B', [self._opcodes[i] for i in permutation])
+      self._operands = array('I', [self._operands[i] for i in permutation])
+      self.set_orders([orders[i] for i in permutation])
+
+   # Plain data of the program for marshal, nil is stored as None
+   def get_data(self):
+      arguments = list(self._arguments.values())
+      numbers = {id(arg): number for number, arg in enumerate(arguments)}
+
+      arguments_data = []
+      for arg in arguments:
+         value = None if arg.get_type() == 'nil' else arg.get_value()
+         arguments_data.append((arg.get_order(), arg.get_type(), value, arg.get_frame(), arg.get_name()))
+
+      args_pool = [tuple(numbers[id(arg)] for arg in args) for args in self._args_pool]
+
+      return (self._opcodes.tobytes(), list(self._orders), self._operands.tobytes(), args_pool, arguments_data)
+
+   # Build the program again from the data of get_data(), raises ValueError
+   # if the data is not of the same shape
+   @staticmethod
+   def from_data(data):
+      if type(data) is not tuple or len(data) != 5:
+         raise ValueError('wrong program data')
+      opcodes, orders, operands, args_pool, arguments_data = data
+
+      program = Program()
+      program._opcodes.frombytes(opcodes)
+      program._operands.frombytes(operands)
+      if type(orders) is not list or any(type(order) is not int for order in orders):
+         raise ValueError('wrong orders')
+      if not len(program._opcodes) == len(program._operands) == len(orders):
+         raise ValueError('wrong number of instructions')
+      program.set_orders(orders)
+
+      arguments = []
+      for number, argument_data in enumerate(arguments_data):
+         if type(argument_data) is not tuple or len(argument_data) != 5:
+            raise ValueError('wrong argument')
+         order, arg_type, value, frame, name = argument_data
+         if type(value) is not argument_value_types.get(arg_type):
+            raise ValueError('wrong argument value')
+         if arg_type == 'var' and (frame not in ('GF', 'LF', 'TF') or type(name) is not str):
+            raise ValueError('wrong variable')
+
+         if arg_type == 'nil':
+            value = NIL
+         arg = Argument(order, arg_type, value)
+         arg.set_frame(frame)
+         arg.set_name(name)
+         arguments.append(arg)
+         program._arguments[number] = arg
+
+      for args in args_pool:
+         if type(args) is not tuple or any(type(number) is not int or not 0 <= number < len(arguments) for number in args):
+            raise ValueError('wrong arguments')
+      program._args_pool = [tuple(arguments[number] for number in args) for args in args_pool]
+
+      # Each instruction has a known opcode and it's number of arguments
+      for i in range(len(program)):
+         if program._opcodes[i] >= len(opcode_names) or program._operands[i] >= len(program._args_pool):
+            raise ValueError('wrong instruction')
+         if len(program.get_args(i)) != len(opcode_operands[program.get_opcode(i)]):
+            raise ValueError('wrong number of arguments')
+
+      return program
+
+class LineCursor:
+
+   # Reads the input for the READ instruction line by line, each line
+   # is cut out of the text only when it's read. Like with split('\n'),
+   # the text after the last new line is the last line, even if empty.
+
+   def __init__(self, text):
+      self._text = text
+      self._position = 0
+
+   # Returns the next line, None after the last line
+   def read_line(self):
+
+      if self._position is None:
+         return None
+
+      end = self._text.find('\n', self._position)
+      if end == -1:
+         line = self._text[self._position:]
+         self._position = None
+      else:
+         line = self._text[self._position:end]
+         self._position = end + 1
+
+      return line
+
+
+
+class MappedInput:
+
+   # Reads the input for the READ instruction from a memory mapped file,
+   # only the line being read is decoded. The lines are read in order, so
+   # only the offset of the next line is kept. The new lines are the same
+   # as in a file opened in text mode, '\n', '\r\n' and '\r'.
+
+   newline_pattern = re.compile(rb"\r\n|\r|\n")
+
+   def __init__(self, input_name):
+      with open(input_name, 'rb') as input_file:
+         self._mapping = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+      self._encoding = locale.getpreferredencoding(False)
+      self._offset = 0
 
-      frame = self.get_frame()
+   # Returns the next line, None after the last line
+   def read_line(self):
 
-      # If variable exists, set it's value and type
-      if self._name in frame:
-         frame[self._name] = [self._value, self._type]
+      if self._offset is None:
+         return None
+
+      # Like with split('\n'), the text after the last new line
+      # is the last line, even if empty
+      match = self.newline_pattern.search(self._mapping, self._offset)
+      if match is None:
+         line = self._mapping[self._offset:]
+         self._offset = None
       else:
-            print_error(f'Error: undefined variable {self._name}', ERR_VAR_MISSING)
+         line = self._mapping[self._offset:match.start()]
+         self._offset = match.end()
 
-   def get_value(self):
+      return line.decode(self._encoding)
 
-      frame = self.get_frame()
-      
-      # If variable exists, get it's value, if it's unset, raise an error
-      if self._name in frame:
-         self._value = frame[self._name][0]
-         if self._value == None:
-            print_error(f'Error: unset variable value {self._name}', ERR_VALUE_MISSING)
-         else:
-            return self._value
+
+
+class LineReader:
+
+   # Reads the input for the READ instruction from a text stream, each
+   # line only when it's read. The stream must not translate the new lines.
+   # Like with split('\n'), the text after the last new line is the last
+   # line, even if empty.
+
+   def __init__(self, stream):
+      self._stream = stream
+      self._finished = False
+
+   # Returns the next line, None after the last line
+   def read_line(self):
+
+      if self._finished:
+         return None
+
+      line = self._stream.readline()
+      if line.endswith('\n'):
+         return line[:-1]
+
+      self._finished = True
+      return line
+
+
+
+class InputStream:
+
+   # Reads the input for the READ instruction from a text stream, which
+   # does not need to be closed before the interpretation starts. A
+   # background thread reads whatever data is available, splits it into
+   # lines and puts them into a queue of a limited size, so only a few
+   # blocks of the input are in memory at once.
+
+   block_size = 65536
+   queue_size = 16
+
+   def __init__(self, stream):
+      self._queue = queue.Queue(self.queue_size)
+      self._lines = []
+      self._position = 0
+      self._finished = False
+
+      thread = threading.Thread(target=self.read_ahead, args=(stream,), daemon=True)
+      thread.start()
+
+   def read_ahead(self, stream):
+
+      # Decode the bytes the same way as the text stream would, sys.stdin
+      # does not translate the new lines. The file descriptor is read
+      # directly, the buffer would stay locked by this thread while the
+      # program exits.
+      decoder = codecs.getincrementaldecoder(stream.encoding)(stream.errors)
+
+      try:
+         rest = ''
+         while True:
+            data = os.read(stream.fileno(), self.block_size)
+            lines = (rest + decoder.decode(data, final=not data)).split('\n')
+            rest = lines.pop()
+            if lines:
+               self._queue.put(lines)
+            if not data:
+               break
+
+         # Like with split('\n'), the text after the last new line
+         # is the last line, even if empty
+         self._queue.put([rest])
+      finally:
+         self._queue.put(None)
+
+   # Returns the next line, None after the last line
+   def read_line(self):
+
+      while self._position >= len(self._lines):
+         if self._finished:
+            return None
+
+         lines = self._queue.get()
+         if lines is None:
+            self._finished = True
+            return None
+
+         self._lines = lines
+         self._position = 0
+
+      line = self._lines[self._position]
+      self._position += 1
+      return line
+
+
+
+class AsyncLineSource:
+
+   # Reads the input for the READ instruction of a program run by the
+   # scheduler from an asyncio.StreamReader. The scheduler awaits
+   # wait_line() before each READ, so read_line() never blocks the other
+   # programs. Like with LineReader, the new lines are not translated.
+
+   def __init__(self, reader, encoding):
+      self._reader = reader
+      self._encoding = encoding
+      self._line = None
+      self._finished = False
+
+   # Whether read_line() can return without waiting
+   def is_ready(self):
+      return self._line is not None or self._finished
+
+   # Wait until the next line is read
+   async def wait_line(self):
+      if self.is_ready():
+         return
+
+      line = (await self._reader.readline()).decode(self._encoding)
+      if line.endswith('\n'):
+         self._line = line[:-1]
       else:
-         print_error('Error: undefined variable', ERR_VAR_MISSING)
-   
-   # Same as get_value() but without the 'unset variable' check
-   # Used in SETCHAR and TYPE instructions
-   def get_value_unset(self):
+         self._line = line
+         self._finished = True
+
+   # Returns the next line, None after the last line
+   def read_line(self):
+      line = self._line
+      self._line = None
+      return line
+
+
+
+class OutputWriter:
+
+   # Collects the output of the WRITE instruction and writes it to the
+   # binary stream in large blocks. With the 'line' policy the output is
+   # written after each new line, with 'immediate' after each WRITE.
+
+   block_size = 65536
+
+   def __init__(self, stream, encoding, errors, policy):
+      self._stream = stream
+      self._encoding = encoding
+      self._errors = errors
+      self._chunks = []
+      self._size = 0
+      self._limit = 0 if policy == 'immediate' else self.block_size
+      self._line = policy == 'line'
+
+   def write(self, text):
+      self._chunks.append(text)
+      self._size += len(text)
+
+      if self._size >= self._limit or (self._line and '\n' in text):
+         self.flush()
+
+   def flush(self):
+      if self._chunks:
+         data = ''.join(self._chunks).encode(self._encoding, self._errors)
+         self._chunks = []
+         self._size = 0
+         self._stream.write(data)
+
+      self._stream.flush()
+
+
+
+class ProgramLoader:
+
+   # Loads the XML program in one streaming pass, each instruction
+   # is checked and built as soon as its element ends, so the
+   # whole document tree is never held in memory
+
+   def __init__(self):
+      self._program = Program()
+      self._depth = 0
+      self._opcode = None
+      self._order = None
+      self._args = None
+      self._arg_tag = None
+      self._arg_type = None
+      self._arg_text = None
+      self._collect_text = False
+
+      # Structure errors are reported only after the whole file is read,
+      # so that a malformed XML is still reported as ERR_XML_FORMAT
+      self._error = None
+
+   def load(self, source):
+
+      parser = expat.ParserCreate()
+      parser.buffer_text = True
+      parser.StartElementHandler = self.start_element
+      parser.EndElementHandler = self.end_element
+      parser.CharacterDataHandler = self.char_data
+
+      try:
+         parser.ParseFile(source)
+      except expat.ExpatError:
+         print_error('Error: invalid XML format', ERR_XML_FORMAT)
+
+      if self._error is not None:
+         print_error(self._error, ERR_XML_STRUCT)
+
+      return self._program
+
+   def set_error(self, err_message):
+      if self._error is None:
+         self._error = err_message
+
+   def start_element(self, tag, attributes):
+      self._depth += 1
+
+      # Text after a nested element does not belong to the argument
+      self._collect_text = False
+
+      if self._error is not None:
+         return
+
+      # Program element
+      if self._depth == 1:
+
+         # Check program attributes
+         root_attributes = set(attributes.keys())
+         if not(root_attributes in [{'language'}, {'language', 'description'}, {'language', 'name'}, {'language', 'name', 'description'}]):
+            self.set_error('Error: wrong program attributes')
+
+         # Check program attribute 'language'
+         elif attributes['language'].upper() != 'IPPCODE23':
+            self.set_error('Error: wrong program code, should be IPPcode23')
+
+      # Instruction element
+      elif self._depth == 2:
 
-      frame = self.get_frame()
+         if tag != 'instruction':
+            self.set_error('Error: unexpected XML structure')
 
-      # If variable exists, retrieve it's value, even if it's unset
-      if self._name in frame:
-         self._value = frame[self._name][0]
-         return self._value
+         # Each instruction must have an order and opcode
+         elif not(set(attributes.keys()) == {'order', 'opcode'}):
+            self.set_error('Error: unexpected XML structure')
+
+         else:
+            self._opcode = attributes['opcode']
+            self._order = attributes['order']
+            self._args = []
+
+      # Argument element
+      elif self._depth == 3:
+
+         # Each argument must have a type
+         if not(set(attributes.keys()) == {'type'}):
+            self.set_error('Error: unexpected XML structure')
+
+         # Check type value
+         elif not(attributes['type'] in ['int', 'bool', 'string', 'nil', 'label', 'type', 'var', 'float', 'symb']):
+            self.set_error('Error: unexpected XML structure')
+
+         # Check the tag itself
+         elif tag not in ('arg1', 'arg2', 'arg3'):
+            self.set_error('Error: wrong argument numbers')
+
+         else:
+            self._arg_tag = tag
+            self._arg_type = attributes['type']
+            self._arg_text = None
+            self._collect_text = True
+
+   def end_element(self, tag):
+      self._depth -= 1
+      self._collect_text = False
+
+      if self._error is not None:
+         return
+
+      # End of an argument, add it to it's instruction
+      if self._depth == 2:
+         arg_text = None
+         if self._arg_text != None:
+            arg_text = self._arg_text.strip()
+
+         self._args.append((int(self._arg_tag[3]), self._arg_type, arg_text))
+
+      # End of an instruction, sort the arguments and add it to the program
+      elif self._depth == 1:
+         self._program.add_instruction(self._opcode, self._order, sort_arguments(self._args))
+         self._args = None
+
+   def char_data(self, text):
+      if self._collect_text:
+         if self._arg_text is None:
+            self._arg_text = text
+         else:
+            self._arg_text += text
+
+
+
+class SourceTextLoader:
+
+   # Loads the program straight from the IPPcode23 source text,
+   # the checks are the same as the ones in parse.php
+
+   var_pattern = re.compile(r"^(LF|GF|TF)@[a-zA-Z_$&%*!?-][a-zA-Z0-9_$&%*!?-]*")
+   label_pattern = re.compile(r"^[a-zA-Z_$&%*!?-][a-zA-Z0-9_$&%*!?-]*")
+   type_pattern = re.compile(r"^(int|string|bool)$")
+   header_pattern = re.compile(r"^\s*\.IPPcode23\s*(?:#.*)?$")
+   whitespace_pattern = re.compile(r"[ \t\n\r\f\v]+")
+
+   # Constants accepted by check_symb() in parse.php
+   check_symb_patterns = [
+      re.compile(r"^bool@(true|false)"),
+      re.compile(r"^nil@nil$"),
+      re.compile(r"^int@((-?|\+?)[0-9]\d*)"),
+      re.compile(r"^string@(?:[^\s\\]|\\[0-9]{3})*$")
+   ]
+
+   # Constants accepted by is_symb() in parse.php
+   is_symb_patterns = [
+      re.compile(r"^bool@(true|false)$"),
+      re.compile(r"^nil@nil$"),
+      re.compile(r"^int@(((-|\+)?(0[xX][0-9a-fA-F]+(_[0-9a-fA-F]+)*)|(0[oO]?[0-7]+(_[0-7]+)*)|((0[bB][01]+(_[01]+)*))|([1-9]\d*)))\b"),
+      re.compile(r"^string@(?:[^\s\\]|\\[0-9]{3})*$")
+   ]
+
+   def load(self, source):
+
+      program = Program()
+      header = False
+
+      for line in source:
+         # Invalid UTF-8 fails like in the XML source
+         try:
+            line = line.decode('utf-8')
+         except UnicodeDecodeError:
+            print_error('Error: invalid UTF-8 in the source', ERR_XML_FORMAT)
+
+         # Strip comments, trim the line and remove excess whitespaces
+         line = line.split('#')[0]
+         line = self.whitespace_pattern.sub(' ', line.strip(' \t\n\r\0\x0b'))
+
+         # Skip empty lines
+         if line.strip(' ') == '':
+            continue
+
+         # Check for header
+         if not header:
+            if not self.header_pattern.match(line):
+               print_error('Error: missing or wrong header', ERR_HEADER)
+            header = True
+            continue
+
+         # Explode line into words, the first one is the instruction
+         words = line.strip(' ').split(' ')
+         opcode = words[0].upper()
+
+         if opcode not in opcode_operands:
+            print_error(f'Error: unknown instruction {words[0]}', ERR_OPCODE)
+
+         # Check the number of operands
+         operands = opcode_operands[opcode]
+         if len(words) != len(operands) + 1:
+            print_error(f'Error: wrong number of operands of {opcode}', ERR_LEXICAL)
+
+         args = []
+         for arg_order, (kind, word) in enumerate(zip(operands, words[1:]), 1):
+            arg_type, value = self.get_operand(kind, word)
+            args.append((arg_order, arg_type, value))
+
+         program.add_instruction(opcode, len(program) + 1, tuple(args))
+
+      # Even an empty program needs the header
+      if not header:
+         print_error('Error: missing header', ERR_HEADER)
+
+      return program
+
+   # Check one operand and return it's type and value like in the XML
+   def get_operand(self, kind, word):
+
+      if kind == 'var':
+         if not self.var_pattern.match(word):
+            print_error(f'Error: invalid variable {word}', ERR_LEXICAL)
+         return 'var', word
+
+      if kind == 'type':
+         if not self.type_pattern.match(word):
+            print_error(f'Error: invalid type {word}', ERR_LEXICAL)
+         return 'type', word
+
+      if kind == 'label':
+         if self.var_pattern.match(word) or self.type_pattern.match(word) or self.is_symb(word) or not self.label_pattern.match(word):
+            print_error(f'Error: invalid label {word}', ERR_LEXICAL)
+         return 'label', word
+
+      # Symbol, either a variable or a constant
+      if self.var_pattern.match(word):
+         return 'var', word
+
+      if not any(pattern.match(word) for pattern in self.check_symb_patterns):
+         print_error(f'Error: invalid symbol {word}', ERR_LEXICAL)
+
+      arg_type, value = word.split('@', 1)
+
+      # Empty constants are empty elements in the XML
+      if value == '':
+         value = None
+
+      return arg_type, value
+
+   def is_symb(self, word):
+      return bool(self.var_pattern.match(word)) or any(pattern.match(word) for pattern in self.is_symb_patterns)
+
+
+
+class ProgramCache:
+
+   # Cache of loaded programs, each program is stored in one file
+   # named by the hash of the XML source and the interpret version. The
+   # file starts with the SHA-256 digest of the key and the data, so a
+   # damaged entry or an entry of another key is never used.
+
+   def __init__(self, directory, max_size):
+      self._directory = directory
+      self._max_size = max_size
+
+   def get_path(self, key):
+      return os.path.join(self._directory, key + '.prog')
+
+   def get_digest(self, key, data):
+      return hashlib.sha256(key.encode() + data).digest()
+
+   # Returns the instructions and labels, or None on a cache miss
+   def load(self, key):
+
+      path = self.get_path(key)
+      try:
+         with open(path, 'rb') as cache_file:
+            entry = cache_file.read()
+      except OSError:
+         return None
+
+      # Build the program again from the plain data, an entry which is
+      # damaged or has a wrong shape is a miss and it's removed
+      try:
+         digest, data = entry[:32], entry[32:]
+         if digest != self.get_digest(key, data):
+            raise ValueError('wrong digest')
+
+         program_data, labels = marshal.loads(data)
+         program = Program.from_data(program_data)
+         if type(labels) is not dict or any(type(label) is not str or type(position) is not int or not 0 <= position < len(program) for label, position in labels.items()):
+            raise ValueError('wrong labels')
+      except (EOFError, ValueError, TypeError, IndexError, OverflowError):
+         self.remove(path)
+         return None
+
+      self.touch(path)
+
+      return program, labels
+
+   # Mark the entry or the compiled module as recently used
+   def touch(self, path):
+      try:
+         os.utime(path)
+      except OSError:
+         pass
+
+   def remove(self, path):
+      try:
+         os.remove(path)
+      except OSError:
+         pass
+
+   def store(self, key, program, labels):
+
+      # Only plain data is stored, so that marshal can be used
+      program_data = program.get_data()
+
+      # Write a temporary file first and then move it into place,
+      # so that other runs never see a half written entry
+      path = self.get_path(key)
+      try:
+         os.makedirs(self._directory, mode=0o700, exist_ok=True)
+         tmp_path = f'{path}.{os.getpid()}.tmp'
+         with open(tmp_path, 'wb') as cache_file:
+            data = marshal.dumps((program_data, labels))
+            cache_file.write(self.get_digest(key, data) + data)
+         os.replace(tmp_path, path)
+      except OSError:
+         return
+
+      self.evict()
+
+   # Remove the least recently used entries and compiled modules over
+   # the size limit, the bytecode of a module in __pycache__ is counted
+   # and removed together with it
+   def evict(self):
+
+      entries = []
+      total_size = 0
+      try:
+         with os.scandir(self._directory) as directory:
+            for entry in directory:
+               if entry.name.endswith(('.prog', '.py')):
+                  status = entry.stat()
+                  paths = [entry.path]
+                  size = status.st_size
+                  if entry.name.endswith('.py'):
+                     bytecode_path = importlib.util.cache_from_source(entry.path)
+                     try:
+                        size += os.stat(bytecode_path).st_size
+                        paths.append(bytecode_path)
+                     except OSError:
+                        pass
+                  entries.append((status.st_mtime, size, paths))
+                  total_size += size
+      except (OSError, NotImplementedError):
+         return
+
+      entries.sort()
+      for mtime, size, paths in entries:
+         if total_size <= self._max_size:
+            break
+         for path in paths:
+            self.remove(path)
+         total_size -= size
+
+
+
+class StringBuilder:
+
+   # Value of a string variable, which is appended to by CONCAT or changed
+   # by SETCHAR, so that building a long string is not quadratic. The
+   # appended strings are kept as a list of parts, after the first GETCHAR
+   # or SETCHAR as a list of characters, which can be changed in place.
+   # It's joined into a string as soon as the variable is read by any
+   # other instruction, so it's never shared by two variables.
+
+   __slots__ = ('_parts', '_chars', '_length')
+
+   def __init__(self, text):
+      self._parts = [text]
+      self._chars = None
+      self._length = len(text)
+
+   def __len__(self):
+      return self._length
+
+   def __getitem__(self, index):
+      return self.get_chars()[index]
+
+   # List of the characters, the parts are split only once
+   def get_chars(self):
+      if self._chars is None:
+         self._chars = list(''.join(self._parts))
+         self._parts = None
+      return self._chars
+
+   def append(self, text):
+      if self._chars is None:
+         self._parts.append(text)
       else:
-         print_error('Error: undefined variable', ERR_VAR_MISSING)
+         self._chars.extend(text)
+      self._length += len(text)
 
-   def set_type(self, type):
-      self._type = type   
+   def set_char(self, index, char):
+      self.get_chars()[index] = char
+
+   def to_string(self):
+      if self._chars is None:
+         return ''.join(self._parts)
+      return ''.join(self._chars)
 
-   def get_type(self):
 
-      frame = self.get_frame()
 
-      # If variable exists, retrieve it's type
-      if self._name in frame:
-         self._type = frame[self._name][1]
-         if self._type == None:
-            self._type = get_variable_type(self.get_value())
-         
-         return self._type
+class Sentinel:
+
+   # Special values, they are never equal to any other value
+   # of the IPPcode23 program
+
+   def __init__(self, name):
+      self._name = name
+
+   def __repr__(self):
+      return self._name
+
+# Nil value, the undefined variable and the defined variable without
+# a value are only used by the compiled programs
+NIL = Sentinel('NIL')
+UNDEFINED = Sentinel('UNDEF')
+UNSET = Sentinel('UNSET')
+
+
+
+class Transpiler:
+
+   # Translates the program into the source of a Python module with one
+   # function. The global variables are local variables of the function,
+   # the local and temporary frames are dicts. The program is split into
+   # blocks, which start at the labels and after the calls, and the next
+   # block is chosen by a binary tree of comparisons of the block number.
+   # Within a block, the values pushed to the data stack are kept in local
+   # variables and only pushed to the stack list before a jump or at the
+   # end of the block.
+
+   # Python types of the IPPcode23 types
+   python_types = {'int': 'int', 'bool': 'bool', 'string': 'str'}
+
+   def __init__(self, program, labels):
+      self._program = program
+      self._globals = {}
+      self._temp_count = 0
+
+      # Values pushed in the current block with their types, None if the
+      # type is not known
+      self._stack = []
+
+      # Find the first instruction of each block, the jumps continue
+      # after the label
+      starts = {0}
+      starts.update(position + 1 for position in labels.values())
+      for i in range(len(program)):
+         if program.get_opcode(i) == 'CALL':
+            starts.add(i + 1)
+      self._starts = sorted(start for start in starts if start < len(program))
+
+      # Block number of each start, the end of the program has the last one
+      self._blocks = {start: block for block, start in enumerate(self._starts)}
+      self._blocks[len(program)] = len(self._starts)
+
+   # Only the programs without float constants can be translated
+   @staticmethod
+   def can_translate(program):
+      for arg in program.get_arguments():
+         if arg.get_type() == 'float':
+            return False
+      return True
+
+   # Returns the source of the module
+   def translate(self, key):
+
+      # Translate each block, it continues with the next one at the end
+      blocks = []
+      for block, start in enumerate(self._starts):
+         end = self._starts[block + 1] if block + 1 < len(self._starts) else len(self._program)
+         lines = []
+         self._stack = []
+         for i in range(start, end):
+            opcode = self._program.get_opcode(i)
+            self._temp_count = 0
+            lines.append(f'# {self._program.get_order(i)}: {opcode}')
+            translate_instruction = getattr(self, 'translate_' + opcode.lower(), self.translate_nothing)
+            translate_instruction(self._program.get_args(i), i, lines)
+         self.add_jump(block + 1, lines)
+         blocks.append(lines)
+      blocks.append(['return'])
+
+      source = [
+         '# IPPcode23 program compiled by interpret.py, do not edit',
+         f'# Key: {key}',
+         '',
+         'def program(error, missing, read, write, format_value, type_name, exit, NIL, UNDEF, UNSET, type=type, len=len, chr=chr, ord=ord, int=int, bool=bool, str=str):'
+      ]
+      for name, local in self._globals.items():
+         source.append(f'   {local} = UNDEF  # GF@{name}')
+      source += ['   lf = None', '   tf = None', '   lfs = []', '   cs = []', '   ds = []', '   pc = 0', '   while True:']
+      self.add_block_tree(source, blocks, 0, len(blocks), 2)
+
+      return '\n'.join(source) + '\n'
+
+   # Add the blocks from low to high, chosen by the block number
+   def add_block_tree(self, source, blocks, low, high, depth):
+      indent = '   ' * depth
+
+      if high - low == 1:
+         for line in blocks[low]:
+            source.append(indent + line)
+         return
+
+      middle = (low + high) // 2
+      source.append(f'{indent}if pc < {middle}:')
+      self.add_block_tree(source, blocks, low, middle, depth + 1)
+      source.append(f'{indent}else:')
+      self.add_block_tree(source, blocks, middle, high, depth + 1)
+
+   def get_global(self, name):
+      if name not in self._globals:
+         self._globals[name] = f'g{len(self._globals)}'
+      return self._globals[name]
+
+   def get_temp(self):
+      self._temp_count += 1
+      return f't{self._temp_count}'
+
+   def get_error(self, err_message, err_code):
+      return f'error({err_message!r}, {err_code})'
+
+   # Type of a constant, None for variables
+   def get_static_type(self, arg):
+      if arg.get_type() == 'var':
+         return None
+      return arg.get_type()
+
+   def get_constant(self, arg):
+      if arg.get_type() == 'nil':
+         return 'NIL'
+      return repr(arg.get_value())
+
+   # Check that the frame of the variable exists
+   def get_frame(self, arg, lines):
+      if arg.get_frame() == 'LF':
+         lines.append(f"if lf is None: {self.get_error('Error: undefined local frame', ERR_FRAME_MISSING)}")
+         return 'lf'
+
+      lines.append(f"if tf is None: {self.get_error('Error: undefined temporary frame', ERR_FRAME_MISSING)}")
+      return 'tf'
+
+   # Value of a variable, which may be undefined or unset
+   def read_var(self, arg, lines):
+      if arg.get_frame() == 'GF':
+         return self.get_global(arg.get_name())
+
+      frame = self.get_frame(arg, lines)
+      value = self.get_temp()
+      lines.append(f'{value} = {frame}.get({arg.get_name()!r}, UNDEF)')
+      return value
+
+   # Value of a constant or a variable
+   def read_symb(self, arg, lines):
+      if arg.get_type() != 'var':
+         return self.get_constant(arg)
+
+      value = self.read_var(arg, lines)
+      name = f'{arg.get_frame()}@{arg.get_name()}'
+      lines.append(f'if {value} is UNDEF or {value} is UNSET: missing({value}, {name!r})')
+      return value
+
+   # Value of a constant or a variable, which must be of the given type
+   def read_typed_symb(self, arg, symb_type, opcode, lines):
+      err = self.get_error(f'Error: argument {arg.get_order()} of {opcode} must be of type {symb_type}', ERR_BAD_TYPE)
+
+      if arg.get_type() != 'var':
+         if arg.get_type() != symb_type:
+            lines.append(err)
+         return self.get_constant(arg)
+
+      value = self.read_symb(arg, lines)
+      lines.append(f'if type({value}) is not {self.python_types[symb_type]}: {err}')
+      return value
+
+   # Assign the value to a variable
+   def write_var(self, arg, value, lines):
+      name = arg.get_name()
+      err = self.get_error(f'Error: undefined variable {name}', ERR_VAR_MISSING)
+
+      if arg.get_frame() == 'GF':
+         var = self.get_global(name)
+         lines.append(f'if {var} is UNDEF: {err}')
+         lines.append(f'{var} = {value}')
       else:
-         print_error('Error: undefined variable', ERR_VAR_MISSING)
-   
-   # Same as get_type(), but without the 'unset variable' check
-   # Used in the TYPE instruction
-   def get_type_unset(self):
-
-      frame = self.get_frame()
-
-      # If variable exists, retrieve it's type
-      if self._name in frame:
-         self._type = frame[self._name][1]
-         if self._type == None:
-            self._type = get_variable_type(self.get_value_unset())
-         
-         return self._type
+         frame = self.get_frame(arg, lines)
+         lines.append(f'if {name!r} not in {frame}: {err}')
+         lines.append(f'{frame}[{name!r}] = {value}')
+
+   # Block of the jump target
+   def get_label_block(self, arg):
+      return self._blocks[arg.get_target()]
+
+   def add_jump(self, block, lines, indent=''):
+      self.flush_stack(lines, indent)
+      lines.append(f'{indent}pc = {block}')
+      lines.append(f'{indent}continue')
+
+   # Push the values kept in local variables to the data stack
+   def flush_stack(self, lines, indent=''):
+      values = [value for value, value_type in self._stack]
+      if len(values) == 1:
+         lines.append(f'{indent}ds.append({values[0]})')
+      elif values:
+         lines.append(f"{indent}ds.extend(({', '.join(values)}))")
+
+   # Read the operands of LT and GT, which must be of the same type and not nil
+   def read_relational(self, args, opcode, lines):
+      value_1 = self.read_symb(args[1], lines)
+      value_2 = self.read_symb(args[2], lines)
+      err = self.get_error(f'Error: second and third argument of {opcode} must be of the same type and not nil', ERR_BAD_TYPE)
+      self.check_relational(value_1, self.get_static_type(args[1]), value_2, self.get_static_type(args[2]), err, lines)
+      return value_1, value_2
+
+   # Check the operands of the relational instructions, the types are None
+   # when they are not known
+   def check_relational(self, value_1, type_1, value_2, type_2, err, lines):
+      if type_1 is not None and type_2 is not None:
+         if type_1 != type_2 or type_1 == 'nil':
+            lines.append(err)
+      elif type_1 is not None or type_2 is not None:
+         known_type, value = (type_1, value_2) if type_1 is not None else (type_2, value_1)
+         if known_type == 'nil':
+            lines.append(err)
+         else:
+            lines.append(f'if type({value}) is not {self.python_types[known_type]}: {err}')
+      else:
+         lines.append(f'if type({value_1}) is not type({value_2}) or {value_1} is NIL: {err}')
+
+   # Compare the operands of EQ, JUMPIFEQ and JUMPIFNEQ, nil can be
+   # compared with anything, otherwise the types must be the same
+   def read_equality(self, args, opcode, lines):
+      value_1 = self.read_symb(args[1], lines)
+      value_2 = self.read_symb(args[2], lines)
+      err = self.get_error(f'Error: second and third argument of {opcode} must be of the same type', ERR_BAD_TYPE)
+      return self.compare_equal(value_1, self.get_static_type(args[1]), value_2, self.get_static_type(args[2]), err, lines)
+
+   # Expression comparing the operands of the equality instructions, the
+   # types are None when they are not known
+   def compare_equal(self, value_1, type_1, value_2, type_2, err, lines):
+      if type_1 is not None and type_2 is not None:
+         if type_1 == 'nil' or type_2 == 'nil':
+            return repr(type_1 == type_2)
+         if type_1 != type_2:
+            lines.append(err)
+            return 'False'
+         return f'{value_1} == {value_2}'
+
+      result = self.get_temp()
+      if type_1 is not None or type_2 is not None:
+         known_type, value, constant = (type_1, value_2, value_1) if type_1 is not None else (type_2, value_1, value_2)
+         if known_type == 'nil':
+            return f'{value} is NIL'
+         lines.append(f'if {value} is NIL: {result} = False')
+         lines.append(f'elif type({value}) is not {self.python_types[known_type]}: {err}')
+         lines.append(f'else: {result} = {value} == {constant}')
+      else:
+         lines.append(f'if {value_1} is NIL or {value_2} is NIL: {result} = {value_1} is {value_2}')
+         lines.append(f'elif type({value_1}) is not type({value_2}): {err}')
+         lines.append(f'else: {result} = {value_1} == {value_2}')
+
+      return result
+
+   def translate_move(self, args, i, lines):
+      value = self.read_symb(args[1], lines)
+      self.write_var(args[0], value, lines)
+
+   def translate_createframe(self, args, i, lines):
+      lines.append('tf = {}')
+
+   def translate_pushframe(self, args, i, lines):
+      lines.append(f"if tf is None: {self.get_error('Error: undefined temporary frame', ERR_FRAME_MISSING)}")
+      lines.append('lfs.append(tf)')
+      lines.append('lf = tf')
+      lines.append('tf = None')
+
+   def translate_popframe(self, args, i, lines):
+      lines.append(f"if lf is None: {self.get_error('Error: no local frame to be popped', ERR_FRAME_MISSING)}")
+      lines.append('tf = lfs.pop()')
+      lines.append('lf = lfs[-1] if lfs else None')
+
+   def translate_defvar(self, args, i, lines):
+      name = args[0].get_name()
+      err = self.get_error(f'Redefinition of variable: {name}', ERR_SEMANTIC)
+
+      if args[0].get_frame() == 'GF':
+         var = self.get_global(name)
+         lines.append(f'if {var} is not UNDEF: {err}')
+         lines.append(f'{var} = UNSET')
       else:
-         print_error('Error: undefined variable', ERR_VAR_MISSING)
+         frame = self.get_frame(args[0], lines)
+         lines.append(f'if {name!r} in {frame}: {err}')
+         lines.append(f'{frame}[{name!r}] = UNSET')
+
+   def translate_call(self, args, i, lines):
+      lines.append(f'cs.append({self._blocks[i + 1]})')
+      self.add_jump(self.get_label_block(args[0]), lines)
+
+   def translate_return(self, args, i, lines):
+      lines.append(f"if not cs: {self.get_error('Error: call stack empty', ERR_VALUE_MISSING)}")
+      self.flush_stack(lines)
+      lines.append('pc = cs.pop()')
+      lines.append('continue')
+
+   def translate_pushs(self, args, i, lines):
+      value = self.read_symb(args[0], lines)
+      value_type = self.get_static_type(args[0])
+
+      # The constants are pushed as they are
+      if value_type is not None:
+         self._stack.append((value, value_type))
+      else:
+         self.push(value, None, lines)
+
+   def translate_pops(self, args, i, lines):
+      (value, value_type), = self.pop_operands(1, self.get_error('Error: empty stack', ERR_VALUE_MISSING), lines)
+      self.write_var(args[0], value, lines)
+
+   def translate_arithmetic(self, args, opcode, operator, lines):
+      value_1 = self.read_typed_symb(args[1], 'int', opcode, lines)
+      value_2 = self.read_typed_symb(args[2], 'int', opcode, lines)
+      if operator == '//':
+         lines.append(f"if {value_2} == 0: {self.get_error('Error: division by 0', ERR_OPERAND_VALUE)}")
+      self.write_var(args[0], f'{value_1} {operator} {value_2}', lines)
+
+   def translate_add(self, args, i, lines):
+      self.translate_arithmetic(args, 'ADD', '+', lines)
+
+   def translate_sub(self, args, i, lines):
+      self.translate_arithmetic(args, 'SUB', '-', lines)
+
+   def translate_mul(self, args, i, lines):
+      self.translate_arithmetic(args, 'MUL', '*', lines)
+
+   def translate_idiv(self, args, i, lines):
+      self.translate_arithmetic(args, 'IDIV', '//', lines)
+
+   def translate_lt(self, args, i, lines):
+      value_1, value_2 = self.read_relational(args, 'LT', lines)
+      self.write_var(args[0], f'{value_1} < {value_2}', lines)
+
+   def translate_gt(self, args, i, lines):
+      value_1, value_2 = self.read_relational(args, 'GT', lines)
+      self.write_var(args[0], f'{value_1} > {value_2}', lines)
+
+   def translate_eq(self, args, i, lines):
+      value = self.read_equality(args, 'EQ', lines)
+      self.write_var(args[0], value, lines)
+
+   def translate_and(self, args, i, lines):
+      value_1 = self.read_typed_symb(args[1], 'bool', 'AND', lines)
+      value_2 = self.read_typed_symb(args[2], 'bool', 'AND', lines)
+      self.write_var(args[0], f'{value_1} and {value_2}', lines)
+
+   def translate_or(self, args, i, lines):
+      value_1 = self.read_typed_symb(args[1], 'bool', 'OR', lines)
+      value_2 = self.read_typed_symb(args[2], 'bool', 'OR', lines)
+      self.write_var(args[0], f'{value_1} or {value_2}', lines)
+
+   def translate_not(self, args, i, lines):
+      value_1 = self.read_typed_symb(args[1], 'bool', 'NOT', lines)
+      self.write_var(args[0], f'not {value_1}', lines)
+
+   def translate_int2char(self, args, i, lines):
+      value_1 = self.read_typed_symb(args[1], 'int', 'INT2CHAR', lines)
+      value = self.get_temp()
+      lines.append('try:')
+      lines.append(f'   {value} = chr({value_1})')
+      lines.append('except (ValueError, OverflowError):')
+      lines.append('   ' + self.get_error('Error: INT2CHAR - cannot convert integer to char', ERR_STRING))
+      self.write_var(args[0], value, lines)
+
+   def translate_stri2int(self, args, i, lines):
+      value_1 = self.read_typed_symb(args[1], 'string', 'STRI2INT', lines)
+      value_2 = self.read_typed_symb(args[2], 'int', 'STRI2INT', lines)
+      lines.append(f"if {value_2} < 0 or {value_2} >= len({value_1}): {self.get_error('Error: STRI2INT - index out of range', ERR_STRING)}")
+      self.write_var(args[0], f'ord({value_1}[{value_2}])', lines)
+
+   def translate_read(self, args, i, lines):
+      value = self.get_temp()
+      lines.append(f'{value} = read({args[1].get_value()!r})')
+      self.write_var(args[0], value, lines)
+
+   def translate_write(self, args, i, lines):
+      if args[0].get_type() != 'var':
+         value = format_value(args[0].get_value())
+         if value != '':
+            lines.append(f'write({value!r})')
+         return
+
+      value = self.read_symb(args[0], lines)
+      lines.append(f'write({value} if type({value}) is str else format_value({value}))')
+
+   def translate_concat(self, args, i, lines):
+      value_1 = self.read_typed_symb(args[1], 'string', 'CONCAT', lines)
+      value_2 = self.read_typed_symb(args[2], 'string', 'CONCAT', lines)
+
+      # When appending to a variable of LF or TF, the string is removed
+      # from the frame first, so Python can extend it in place like the
+      # global variables, which are local variables of the function
+      if is_same_variable(args[0], args[1]) and args[0].get_frame() != 'GF':
+         frame = self.get_frame(args[0], lines)
+         name = args[0].get_name()
+         lines.append(f'{frame}[{name!r}] = None')
+         lines.append(f'{value_1} += {value_2}')
+         lines.append(f'{frame}[{name!r}] = {value_1}')
+         return
+
+      self.write_var(args[0], f'{value_1} + {value_2}', lines)
+
+   def translate_strlen(self, args, i, lines):
+      value_1 = self.read_typed_symb(args[1], 'string', 'STRLEN', lines)
+      self.write_var(args[0], f'len({value_1})', lines)
+
+   def translate_getchar(self, args, i, lines):
+      value_1 = self.read_typed_symb(args[1], 'string', 'GETCHAR', lines)
+      value_2 = self.read_typed_symb(args[2], 'int', 'GETCHAR', lines)
+      lines.append(f"if {value_2} < 0 or {value_2} >= len({value_1}): {self.get_error('Error: GETCHAR - index out of range', ERR_STRING)}")
+      self.write_var(args[0], f'{value_1}[{value_2}]', lines)
+
+   def translate_setchar(self, args, i, lines):
+      value = self.read_typed_symb(args[0], 'string', 'SETCHAR', lines)
+      value_1 = self.read_typed_symb(args[1], 'int', 'SETCHAR', lines)
+      value_2 = self.read_typed_symb(args[2], 'string', 'SETCHAR', lines)
+      lines.append(f"if {value_1} < 0 or {value_1} >= len({value}) or {value_2} == '': {self.get_error('Error: SETCHAR - index out of range', ERR_STRING)}")
+      self.write_var(args[0], f'{value}[:{value_1}] + {value_2}[0] + {value}[{value_1}+1:]', lines)
+
+   def translate_type(self, args, i, lines):
+      if args[1].get_type() != 'var':
+         value = repr(args[1].get_type())
+      else:
+         var = self.read_var(args[1], lines)
+         lines.append(f"if {var} is UNDEF: {self.get_error('Error: undefined variable', ERR_VAR_MISSING)}")
+         value = f'type_name({var})'
 
-   def get_frame(self):
-      
-      # Choose a frame
-      frame = None
-      if self._frame == 'GF':
-         frame = global_frame
-      
-      elif self._frame == 'TF':
-         if tf_not_created == True:
-            print_error('Error: DEFVAR - undefined temporary frame', ERR_FRAME_MISSING)
-         frame = temporary_frame
-      
-      elif self._frame == 'LF':
-         if len(local_frames) ==  0:
-            print_error('Error: DEFVAR - undefined local frame', ERR_FRAME_MISSING)
-         frame = local_frames[-1]
-      
-      return frame
+      self.write_var(args[0], value, lines)
+
+   def translate_jump(self, args, i, lines):
+      self.add_jump(self.get_label_block(args[0]), lines)
+
+   def translate_conditional_jump(self, args, opcode, lines):
+      value = self.read_equality(args, opcode, lines)
+      if opcode == 'JUMPIFEQ':
+         lines.append(f'if {value}:')
+      else:
+         lines.append(f'if not ({value}):')
+      self.add_jump(self.get_label_block(args[0]), lines, '   ')
+
+   def translate_jumpifeq(self, args, i, lines):
+      self.translate_conditional_jump(args, 'JUMPIFEQ', lines)
+
+   def translate_jumpifneq(self, args, i, lines):
+      self.translate_conditional_jump(args, 'JUMPIFNEQ', lines)
+
+   def translate_exit(self, args, i, lines):
+      value = self.read_typed_symb(args[0], 'int', 'EXIT', lines)
+      lines.append(f"if {value} < 0 or {value} > 49: {self.get_error('Error: EXIT - invalid error value', ERR_OPERAND_VALUE)}")
+      lines.append(f'exit({value})')
+
+   # Keep the value in a local variable as the top of the data stack
+   def push(self, value, value_type, lines):
+      var = f's{len(self._stack)}'
+      lines.append(f'{var} = {value}')
+      self._stack.append((var, value_type))
+
+   # Pop the operands of a stack instruction with their types, the last one
+   # is on the top. The ones which are not kept in local variables are
+   # popped from the data stack and their types are not known.
+   def pop_operands(self, count, err, lines):
+      kept = min(count, len(self._stack))
+      operands = [(self.get_temp(), None) for _ in range(count - kept)]
+
+      if operands:
+         lines.append(f'if len(ds) < {len(operands)}: {err}')
+         for value, value_type in reversed(operands):
+            lines.append(f'{value} = ds.pop()')
+
+      if kept:
+         operands += self._stack[-kept:]
+         del self._stack[-kept:]
+
+      return operands
+
+   def get_stack_error(self, opcode):
+      return self.get_error(f'Error: {opcode} - not enough values on the stack', ERR_VALUE_MISSING)
+
+   # Check the type of a stack operand, if it's not known, returns False
+   # if it's known to be wrong
+   def check_operand_type(self, value, value_type, expected_type, err, lines):
+      if value_type is None:
+         lines.append(f'if type({value}) is not {self.python_types[expected_type]}: {err}')
+      elif value_type != expected_type:
+         lines.append(err)
+         return False
+      return True
+
+   # Pop the operands of a stack instruction, which must be of the given type
+   def pop_typed_operands(self, count, operand_type, opcode, lines):
+      operands = self.pop_operands(count, self.get_stack_error(opcode), lines)
+      noun = 'operand' if count == 1 else 'operands'
+      err = self.get_error(f'Error: {noun} of {opcode} must be of type {operand_type}', ERR_BAD_TYPE)
+
+      for value, value_type in operands:
+         self.check_operand_type(value, value_type, operand_type, err, lines)
+
+      return [value for value, value_type in operands]
+
+   # Pop the operands of LTS and GTS, which must be of the same type and not nil
+   def pop_relational_operands(self, opcode, lines):
+      (value_1, type_1), (value_2, type_2) = self.pop_operands(2, self.get_stack_error(opcode), lines)
+      err = self.get_error(f'Error: operands of {opcode} must be of the same type and not nil', ERR_BAD_TYPE)
+      self.check_relational(value_1, type_1, value_2, type_2, err, lines)
+      return value_1, value_2
+
+   # Compare the operands of EQS, JUMPIFEQS and JUMPIFNEQS
+   def pop_equality(self, opcode, lines):
+      (value_1, type_1), (value_2, type_2) = self.pop_operands(2, self.get_stack_error(opcode), lines)
+      err = self.get_error(f'Error: operands of {opcode} must be of the same type', ERR_BAD_TYPE)
+      return self.compare_equal(value_1, type_1, value_2, type_2, err, lines)
+
+   def translate_clears(self, args, i, lines):
+      self._stack = []
+      lines.append('ds.clear()')
+
+   def translate_stack_arithmetic(self, opcode, operator, lines):
+      value_1, value_2 = self.pop_typed_operands(2, 'int', opcode, lines)
+      if operator == '//':
+         lines.append(f"if {value_2} == 0: {self.get_error('Error: division by 0', ERR_OPERAND_VALUE)}")
+      self.push(f'{value_1} {operator} {value_2}', 'int', lines)
+
+   def translate_adds(self, args, i, lines):
+      self.translate_stack_arithmetic('ADDS', '+', lines)
+
+   def translate_subs(self, args, i, lines):
+      self.translate_stack_arithmetic('SUBS', '-', lines)
+
+   def translate_muls(self, args, i, lines):
+      self.translate_stack_arithmetic('MULS', '*', lines)
+
+   def translate_idivs(self, args, i, lines):
+      self.translate_stack_arithmetic('IDIVS', '//', lines)
+
+   def translate_lts(self, args, i, lines):
+      value_1, value_2 = self.pop_relational_operands('LTS', lines)
+      self.push(f'{value_1} < {value_2}', 'bool', lines)
+
+   def translate_gts(self, args, i, lines):
+      value_1, value_2 = self.pop_relational_operands('GTS', lines)
+      self.push(f'{value_1} > {value_2}', 'bool', lines)
+
+   def translate_eqs(self, args, i, lines):
+      value = self.pop_equality('EQS', lines)
+      self.push(value, 'bool', lines)
+
+   def translate_ands(self, args, i, lines):
+      value_1, value_2 = self.pop_typed_operands(2, 'bool', 'ANDS', lines)
+      self.push(f'{value_1} and {value_2}', 'bool', lines)
+
+   def translate_ors(self, args, i, lines):
+      value_1, value_2 = self.pop_typed_operands(2, 'bool', 'ORS', lines)
+      self.push(f'{value_1} or {value_2}', 'bool', lines)
+
+   def translate_nots(self, args, i, lines):
+      value_1, = self.pop_typed_operands(1, 'bool', 'NOTS', lines)
+      self.push(f'not {value_1}', 'bool', lines)
+
+   def translate_int2chars(self, args, i, lines):
+      value_1, = self.pop_typed_operands(1, 'int', 'INT2CHARS', lines)
+      value = self.get_temp()
+      lines.append('try:')
+      lines.append(f'   {value} = chr({value_1})')
+      lines.append('except (ValueError, OverflowError):')
+      lines.append('   ' + self.get_error('Error: INT2CHARS - cannot convert integer to char', ERR_STRING))
+      self.push(value, 'string', lines)
+
+   def translate_stri2ints(self, args, i, lines):
+      (value_1, type_1), (value_2, type_2) = self.pop_operands(2, self.get_stack_error('STRI2INTS'), lines)
+      err = self.get_error('Error: operands of STRI2INTS must be of type string and int', ERR_BAD_TYPE)
+      if not (self.check_operand_type(value_1, type_1, 'string', err, lines) and self.check_operand_type(value_2, type_2, 'int', err, lines)):
+         return
+      lines.append(f"if {value_2} < 0 or {value_2} >= len({value_1}): {self.get_error('Error: STRI2INTS - index out of range', ERR_STRING)}")
+      self.push(f'ord({value_1}[{value_2}])', 'int', lines)
+
+   def translate_jumpifeqs(self, args, i, lines):
+      value = self.pop_equality('JUMPIFEQS', lines)
+      lines.append(f'if {value}:')
+      self.add_jump(self.get_label_block(args[0]), lines, '   ')
+
+   def translate_jumpifneqs(self, args, i, lines):
+      value = self.pop_equality('JUMPIFNEQS', lines)
+      lines.append(f'if not ({value}):')
+      self.add_jump(self.get_label_block(args[0]), lines, '   ')
+
+   # Same as execute_nothing()
+   def translate_nothing(self, args, i, lines):
+      pass
+
+
+
+class Interpreter:
+
+   # Runs a program given in memory, so that many programs can be run by
+   # one process without the files and the exits of interpret.py. The
+   # program is loaded once by the constructor and then it can be run many
+   # times, each run gets the input of READ as a string and returns the
+   # output and the exit code. The errors raise InterpretError. Each
+   # instance has it's own state, which is swapped into the module globals
+   # only while the program is loaded or run, so the instances cannot be
+   # used by more threads at once.
+
+   def __init__(self, source, source_format='xml'):
+      if isinstance(source, str):
+         source = source.encode('utf-8')
+      loader = load_source_text if source_format == 'text' else load_program
+
+      current = swap_state(create_state(None, None))
+      try:
+         self._program = loader(io.BytesIO(source))
+         self._labels = find_labels(self._program)
+         link_labels(self._program, self._labels)
+         assign_slots(self._program)
+         self._code = prepare_code(self._program)
+         self._global_size = len(global_frame[0])
+         self._local_size = local_frame_size
+      finally:
+         swap_state(current)
+
+   # Run the program with the input, returns the output and the exit code
+   def run(self, input_text=''):
+      stdout = io.BytesIO()
+      state = create_state(LineCursor(input_text), OutputWriter(stdout, 'utf-8', 'surrogatepass', 'block'))
+      state['instructions'] = self._program
+      state['labels'] = self._labels
+      state['global_frame'] = ([None] * self._global_size, [None] * self._global_size)
+      state['local_frame_size'] = self._local_size
+
+      current = swap_state(state)
+      try:
+         run_code(self._code)
+         code = ERR_OK
+      except SystemExit as exit_error:
+         code = exit_error.code
+      except InterpretError as error:
+         error.output = stdout.getvalue().decode('utf-8', 'surrogatepass')
+         raise
+      finally:
+         swap_state(current)
+
+      return stdout.getvalue().decode('utf-8', 'surrogatepass'), code
 
 
 
 ################################# FUNCTIONS ###################################
 
+# Raise the error of the exit code, the message is written by main()
 def print_error(err_message, err_code):
-   sys.stderr.write(err_message + '\n')
-   exit(err_code)
+
+   # Write out the output of the program before the error
+   if output is not None:
+      output.flush()
+
+   raise error_classes[err_code](err_message, err_code)
 
 # Check program input arguments
 def check_input_arguments():
    # Help message
-   help_message = "Interpret of the IPPcode23 language.\n\nArguments:\n  --source SOURCE  File with the XML representation of the source code.\n  --input INPUT    File with the inputs for the actual interpretation of the given source code."
+   help_message = "Interpret of the IPPcode23 language.\n\nArguments:\n  --source SOURCE  File with the XML representation of the source code.\n  --input INPUT    File with the inputs for the actual interpretation of the given source code.\n  --source-text SOURCE  File with the IPPcode23 source code, used instead of --source.\n  --cache-dir DIR  Directory for caching the loaded programs.\n  --cache-size MB  Maximum size of the program cache directory.\n  --compile        Translate the program to Python before running it, with --cache-dir the module is kept there.\n  --flush POLICY   When the output is written, after each 'block' (default), 'line' or WRITE ('immediate').\n  --batch DIR      Run the tests NAME.src, NAME.in, NAME.out and NAME.rc in the directory and write a report.\n  --serve SOCKET   Run the programs sent by interpret_client.py to the Unix socket.\n  --jobs N         Number of processes running the tests of --batch or the programs of --serve, the number of CPUs by default.\n  --timeout SECONDS  Time limit of each test of --batch, 10 by default, 0 for no limit.\n  --profile        Write the counts and times of the opcodes, instructions and called labels to stderr, the program is always interpreted.\n  --async N        With --serve, run the programs of each process together in an event loop, switching after N instructions.\n  --inputs-from LIST  Run the program for each input file listed in the file, one per line.\n  --results DIR    Directory for the outputs and the manifest of --inputs-from, LIST.results by default."
 
    # Create an instance of ArgumentParser and set the help message
    parser = argparse.ArgumentParser(description=help_message)
@@ -303,96 +1782,130 @@ def check_input_arguments():
    # Define arguments
    parser.add_argument('--source', type=str, help='file with the XML representation of the source code')
    parser.add_argument('--input', type=str, help='file with the inputs for the actual interpretation of the given source code')
+   parser.add_argument('--source-text', type=str, help='file with the IPPcode23 source code, used instead of --source')
+   parser.add_argument('--cache-dir', type=str, help='directory for caching the loaded programs')
+   parser.add_argument('--cache-size', type=int, default=64, help='maximum size of the program cache directory in MB')
+   parser.add_argument('--compile', action='store_true', help='translate the program to Python before running it, with --cache-dir the module is kept there')
+   parser.add_argument('--flush', type=str, default='block', help='when the output is written, after each block, line or WRITE (immediate)')
+   parser.add_argument('--batch', type=str, help='run the tests NAME.src, NAME.in, NAME.out and NAME.rc in the directory and write a report')
+   parser.add_argument('--serve', type=str, help='run the programs sent by interpret_client.py to the Unix socket')
+   parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='number of processes running the tests of --batch or the programs of --serve')
+   parser.add_argument('--timeout', type=float, default=10.0, help='time limit of each test of --batch in seconds, 0 for no limit')
+   parser.add_argument('--profile',  action='store_true', help='write the counts and times of the opcodes, instructions and called labels to stderr')
+   parser.add_argument('--async',  type=int, dest='async_slice', help='with --serve, run the programs of each process together in an event loop, switching after N instructions')
+   parser.add_argument('--inputs-from', type=str, help='run the program for each input file listed in the file, one per line')
+   parser.add_argument('--results', type=str, help='directory for the outputs and the manifest of --inputs-from, LIST.results by default')
 
    # Parse the command line arguments
    args = parser.parse_args()
 
+   # The batch and the server run their own sources and inputs
+   if args.batch is not None or args.serve is not None:
+      if args.source or args.source_text or args.input or args.inputs_from or (args.batch and args.serve):
+         print_error('--batch and --serve cannot be used with each other or with --source, --source-text, --input or --inputs-from', ERR_PARAM)
+      if args.jobs < 1:
+         print_error('Error: --jobs must be at least 1', ERR_PARAM)
+      if args.timeout < 0:
+         print_error('Error: --timeout must not be negative', ERR_PARAM)
+      if args.serve is not None and not hasattr(socket, 'AF_UNIX'):
+         print_error('Error: --serve needs Unix domain sockets', ERR_PARAM)
+      if args.async_slice is not None and (args.serve is None or args.async_slice < 1):
+         print_error('Error: --async needs --serve and at least 1 instruction', ERR_PARAM)
+      if args.profile:
+         print_error('Error: --profile cannot be used with --batch or --serve', ERR_PARAM)
+      return args
+
+   if args.async_slice is not None:
+      print_error('Error: --async needs --serve and at least 1 instruction', ERR_PARAM)
+
    # At least one parameter needs to be present
-   if not args.source and not args.input:
-      print_error('At least one of --source or --input must be present, ERR_PARAM')
-   
-   return args.source, args.input
+   if not args.source and not args.source_text and not args.input and not args.inputs_from:
+      print_error('At least one of --source, --source-text, --input, --inputs-from, --batch or --serve must be present', ERR_PARAM)
+
+   # The inputs are listed in the file
+   if args.inputs_from is not None:
+      if args.input:
+         print_error('Only one of --input and --inputs-from can be present', ERR_PARAM)
+      if args.profile:
+         print_error('Error: --profile cannot be used with --inputs-from', ERR_PARAM)
+      if args.jobs < 1:
+         print_error('Error: --jobs must be at least 1', ERR_PARAM)
+   elif args.results is not None:
+      print_error('Error: --results needs --inputs-from', ERR_PARAM)
+
+   # There can be only one source
+   if args.source and args.source_text:
+      print_error('Only one of --source and --source-text can be present', ERR_PARAM)
+
+   if args.cache_size < 0:
+      print_error('Error: --cache-size must not be negative', ERR_PARAM)
+
+   if args.flush not in ('block', 'line', 'immediate'):
+      print_error('Error: --flush must be one of block, line or immediate', ERR_PARAM)
 
-# Sorts a list of arguments
+   return args
+
+# Sorts a list of arguments, which are tuples of the order, type and value
 def sort_arguments(arguments):
 
    # There can be instructions with no arguments
    if len(arguments) == 0:
-      return []
+      return ()
+
+   orders = [arg[0] for arg in arguments]
 
    # Check that there are no duplicate tags
-   if len(set(arg.get_order() for arg in arguments)) != len(arguments):
+   if len(set(orders)) != len(orders):
       print_error('Error: duplicate argument tags', ERR_XML_STRUCT)
 
-   # Check list length and order values
-   if len(arguments) == 1:
-         if arguments[0].get_order() != 1:
-            print_error('Error: wrong argument numbers', ERR_XML_STRUCT)
-   elif len(arguments) == 2:
-         if not all([arg.get_order() in [1, 2] for arg in arguments]) or sorted([arg.get_order() for arg in arguments]) != [1, 2]:
-            print_error('Error: wrong argument numbers', ERR_XML_STRUCT)
-   elif len(arguments) == 3:
-         if not all([arg.get_order() in [1, 2, 3] for arg in arguments]) or sorted([arg.get_order() for arg in arguments]) != [1, 2, 3]:
-            print_error('Error: wrong argument numbers', ERR_XML_STRUCT)
+   # Check list length and order values, the tags must be arg1 to argN
+   if max(orders) != len(orders):
+      print_error('Error: wrong argument numbers', ERR_XML_STRUCT)
 
-   # If everything is ok, return the sorted list
-   return sorted(arguments, key=lambda arg: arg.get_order())
+   # If everything is ok, put each argument on it's place
+   sorted_arguments = [None] * len(arguments)
+   for arg in arguments:
+      sorted_arguments[arg[0] - 1] = arg
+
+   return tuple(sorted_arguments)
 
 # Check instruction attributes
-def check_instruction_attributes(list: Instruction):
-   
+def check_instruction_attributes(program: Program):
+
    # Create the seen instruction orders set
    seen_inst = set()
-   for inst in list:
-      # Check number of opcode attribute + number of arguments
-      valid = False
+   for i in range(len(program)):
+      opcode = program.get_opcode(i)
+      args = program.get_args(i)
 
-      # Loop through the global opcodes_and_args list
-      # and find the opcode and argument numbers combination
-      for op in opcodes_and_args:
-         if inst.get_opcode().upper() == op[0] and len(inst.get_args()) == op[1]:
-            valid = True
-            break
-      if not valid:
+      # Check number of opcode attribute + number of arguments
+      operands = opcode_operands.get(opcode)
+      if operands is None or len(args) != len(operands):
          print_error('Error: wrong opcode value or wrong number of instruction arguments', ERR_XML_STRUCT)
-         
-      # Check order attribute
-      try:
-         order = int(inst.get_order())
-      except:
-         print_error('Error: order must be an integer', ERR_XML_STRUCT)
-      
-      # More order checks
+
+      # Check the kind of each argument, the types of the values
+      # are checked later during the interpretation
+      for arg, kind in zip(args, operands):
+         if arg.get_type() not in operand_types[kind]:
+            print_error(f'Error: argument {arg.get_order()} of {opcode} must be of type {kind}', operand_kind_errors.get(opcode, ERR_BAD_TYPE))
+
+      # Order checks, the order is an integer after sorting
+      order = program.get_order(i)
       if order < 1:
          print_error('Error: negative order', ERR_XML_STRUCT)
       if order in seen_inst:
          print_error('Error: duplicate instruction order', ERR_XML_STRUCT)
       seen_inst.add(order)
 
-# Not really used, but if anything goes wrong with the
-# get_type() Variable function, this is the replacement
-def get_variable_type(value):
+# Escape sequence in a string constant
+escape_pattern = re.compile(r"\\(\d\d\d)")
 
-   if value == None:
-      return 'nil'
-   
-   if isinstance(value, int):
-      return 'int'
-   
-   elif isinstance(value, str):
-      if value in ['true', 'false']:
-         return 'bool'
-      if value == 'nil':
-         return 'nil'
-      return 'string'
-
-# Find and replace all escape sequences in a string   
+# Find and replace all escape sequences in a string
 def replace_escape_sequences(text):
 
    if text != None:
       # Use regular expression to find escape sequences
-      pattern = re.compile(r"\\(\d\d\d)")
-      matches = pattern.findall(text)
+      matches = escape_pattern.findall(text)
       
       # Replace escape sequences with corresponding ascii characters
       for match in matches:
@@ -400,1247 +1913,1666 @@ def replace_escape_sequences(text):
       
    return text
 
-################################ BODY ###################################
-
-def main():
-
-   # Global variables
-   global instructions
-   global temporary_frame
-   global local_frames
-   global stack
-   global call_stack
+# Load, sort and check the program from a binary XML source
+def load_program(source):
 
-   # Get the source and input file names
-   source_name, input_name = check_input_arguments()
+   program = ProgramLoader().load(source)
 
-   # This is where the source will be parsed
-   tree = None
-   # This is where the input will be
-   input_file = None
+   # Sort instructions
+   program.sort()
 
-   # Load the tree and input file variables based on the input arguments
-   if source_name is not None:
-      # Load XML
-      try:
-         tree = ElementTree.parse(source_name)
-      except ElementTree.ParseError:
-         print_error('Error: invalid XML format', ERR_XML_FORMAT)
-   
-   if input_name is not None:
-      input_file = open(input_name).read()
-
-   # If stdin input is needed, read it into the appropriate variable
-   if input_file is None:
-      input_file = sys.stdin.read()
-   
-   if tree is None:
-      # Load XML
-      try:
-         tree = ElementTree.parse(sys.stdin)
-      except ElementTree.ParseError:
-         print_error('Error: invalid XML format', ERR_XML_FORMAT)   
-
-   # End of 'Load the tree and input file variables'     
+   # For each instruction in the list, check its attributes
+   check_instruction_attributes(program)
 
-   root = tree.getroot()
+   decode_arguments(program)
 
-   # Check XML
-   root_attributes = list(root.attrib.keys())
+   return program
 
-   # Check program attributes
-   if not((set(root_attributes) == {'language'}) or (set(root_attributes) == {'language', 'description'}) or (set(root_attributes) == {'language', 'name'}) or (set(root_attributes) == {'language', 'name', 'description'})):
-      print_error('Error: wrong program attributes', ERR_XML_STRUCT)
+# Load and check the program from a binary IPPcode23 source text
+def load_source_text(source):
 
-   # Check program attribute 'language'
-   if root.attrib['language'].upper() != 'IPPCODE23':
-      print_error('Error: wrong program code, should be IPPcode23', ERR_XML_STRUCT)
+   program = SourceTextLoader().load(source)
 
-   # Child is instruction in this case
-   for child in root:
+   # The instructions are in order already, but sorting
+   # also stores the orders compactly
+   program.sort()
 
-      if child.tag != 'instruction':
-         print_error('Error: unexpected XML structure', ERR_XML_STRUCT)
+   # For each instruction in the list, check its attributes
+   check_instruction_attributes(program)
 
-      # Each instruction must have an order and opcode
-      child_attributes = list(child.attrib.keys())
-      if not(set(child_attributes) == {'order', 'opcode'}):
-         print_error('Error: unexpected XML structure', ERR_XML_STRUCT)
+   decode_arguments(program)
 
-      # Sub element means arguments of instruction
-      for sub_element in child:
-         sub_element_attributes = list(sub_element.attrib.keys())
+   return program
 
-         # Each argument must have a type
-         if not(set(sub_element_attributes) == {'type'}):
-            print_error('Error: unexpected XML structure', ERR_XML_STRUCT)
+# Decode all different arguments of the program
+def decode_arguments(program):
+   for arg in program.get_arguments():
+      arg.decode()
 
-         # Check type value
-         if not(sub_element.attrib['type'] in ['int', 'bool', 'string', 'nil', 'label', 'type', 'var', 'float', 'symb']):
-            print_error('Error: unexpected XML structure', ERR_XML_STRUCT)
+# Key of the program cache entries and the compiled programs
+def get_source_key(source_data, source_format):
+   key = hashlib.sha256(f'{INTERPRET_VERSION}:{marshal.version}:{source_format}:'.encode())
+   key.update(source_data)
+   return key.hexdigest()
 
-         # Check the tag itself
-         if not(re.match(r"\b(arg1|arg2|arg3)\b", sub_element.tag)):
-            print_error('Error: wrong argument numbers', ERR_XML_STRUCT)
-    
-   # Put all instructions in one list
-   for child in root:
-      instruction = Instruction(child.attrib['opcode'], child.attrib['order'])
-
-      # For each instruction, add it's arguments
-      for sub_element in child:
-         sub_text = None
-         if sub_element.text != None:
-            sub_text = sub_element.text.strip()
-            
-         instruction.add_arg(sub_element.tag, sub_element.attrib['type'], sub_text)
-
-      # Sort the arguments of each instruction and then add it to the list
-      instruction.set_args(sort_arguments(instruction.get_args()))
-      instructions.append(instruction)
-
-   # Sort instructions list
-   try:
-      instructions = sorted(instructions, key=lambda inst: int(inst.get_order()))
-   except:
-      print_error('Error: string order', ERR_XML_STRUCT)
-   
-   # For each instruction in the list, check its attributes
-   check_instruction_attributes(instructions)
-      
-       
-   #for i in instructions:
-   #   print(str(i.get_order()) + " " + str(i.get_opcode()))
-    
-   # Interpret instructions
-   # for i in instructions:
-   #      interpret(i)
+# Save all labels and check duplicity
+def find_labels(program):
 
    labels = {}
 
-   # Save all labels and check duplicity
-   i = 0
-   for inst in instructions:
-      if inst.get_opcode() == 'LABEL':
-         value = inst.get_args()[0].get_value()
+   for i in range(len(program)):
+      if program.get_opcode(i) == 'LABEL':
+         value = program.get_args(i)[0].get_value()
          if value in labels:
             print_error(f'Error: duplicate label: {value}', ERR_SEMANTIC)
-         
+
          labels[value] = i
-      i += 1
-   
-   # Switch
-   i = 0
-   while i < len(instructions):
-      inst = instructions[i]
-      global tf_not_created
 
-      opcode = inst.get_opcode().upper()
-      
-      if opcode == "MOVE":
-         
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
+   return labels
 
-         value = None
-         var_type = None
-
-         # Check for type compatibility and get the value from either a constant or another variable
-         if (arg1.get_type() != 'var'):
-            print_error('Error: first argument of MOVE must be of type var', ERR_BAD_TYPE)
-
-         if (arg2.get_type() in ['int', 'bool', 'string', 'nil', 'float']):
-            value = arg2.get_value()
-            var_type = arg2.get_type()
-            if arg2.get_type() == 'string' and value == None:
-               value = ""
-         elif (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            value = var2.get_value()
-            var_type = var2.get_type()
-         else:
-            print_error('Error: second argument of MOVE must be of type symb', ERR_BAD_TYPE)
-
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
-
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type(var_type)
-         var.set()
-
-      elif opcode == "CREATEFRAME":
-         
-         # Create TF
-         temporary_frame = {}
-         tf_not_created = False
-
-      elif opcode == "PUSHFRAME":
-         
-         # If TF exists, move it to the LF stack, else error
-         if tf_not_created == False:
-            local_frames.append(temporary_frame)
-            tf_not_created = True
-            temporary_frame = {}
-         else:
-            print_error('Error: undefined temporary frame', ERR_FRAME_MISSING)
-
-      elif opcode == "POPFRAME":
-         
-         if len(local_frames) == 0:
-            print_error('Error: no local frame to be popped', ERR_FRAME_MISSING)
-
-         # Pop the topmost LF into TF 
-         temporary_frame = local_frames.pop()
-         tf_not_created = False
-
-      elif opcode == "DEFVAR":
-         
-         arg1 = inst.get_args()[0]
-
-         # Check types
-         if (arg1.get_type() != 'var'):
-            print_error('Error: first argument of DEFVAR must be of type var', ERR_BAD_TYPE)
-
-         # Get the var frame and var name and create a Variable object with these parameters
-         var_frame, var_name = arg1.get_value().split('@')
-         var = Variable(var_name, None, var_frame)
-         
-         # Define the variable
-         var.create()
-
-      elif opcode == "CALL":
-         
-         # Add current position to call stack
-         call_stack.append(i)
-
-         arg1 = inst.get_args()[0]
-
-         # Check types
-         if (arg1.get_type() != 'label'):
-            print_error(f'Error: first argument of {opcode} must be of type label', ERR_BAD_TYPE)
-
-         # Search for the label position and jump there
-         label_name = arg1.get_value()
-         if label_name in labels:
-            i = labels[label_name] # jump
-         else:
-            print_error('Error: undefined label', ERR_SEMANTIC)
+# Give each variable a slot in it's frame. The global frame has it's own
+# slots, the local and temporary frames share the others, because the
+# temporary frame becomes a local frame.
+def assign_slots(program):
+   global global_frame
+   global local_frame_size
+
+   global_slots = {}
+   local_slots = {}
+   for arg in program.get_arguments():
+      if arg.get_type() == 'var':
+         slots = global_slots if arg.get_frame() == 'GF' else local_slots
+         arg.set_slot(slots.setdefault(arg.get_name(), len(slots)))
+
+   global_frame = ([None] * len(global_slots), [None] * len(global_slots))
+   local_frame_size = len(local_slots)
+
+# Store the position after the label on each jump, so that the jumps
+# do not need to look the labels up during the interpretation
+def link_labels(program, labels):
+   for i in range(len(program)):
+      opcode = program.get_opcode(i)
+      if opcode == 'LABEL' or opcode_operands[opcode][:1] != ('label',):
+         continue
+
+      arg = program.get_args(i)[0]
+      if arg.get_value() not in labels:
+         print_error(f'Error: undefined label {arg.get_value()}', ERR_SEMANTIC)
+
+      arg.set_target(labels[arg.get_value()] + 1)
+
+############################### INSTRUCTIONS ################################
+
+# Each instruction has it's own handler, which gets the arguments of the
+# instruction and it's position in the program. The handler returns the
+# position of the next instruction after a jump, otherwise None.
+
+# Get the values and types of the frame of a variable
+def get_frame(arg):
+   frame = arg.get_frame()
+   if frame == 'GF':
+      return global_frame
+
+   if frame == 'TF':
+      if temporary_frame is None:
+         print_error('Error: undefined temporary frame', ERR_FRAME_MISSING)
+      return temporary_frame
+
+   if len(local_frames) == 0:
+      print_error('Error: undefined local frame', ERR_FRAME_MISSING)
+   return local_frames[-1]
+
+# Get the value and type of a constant or a variable
+def get_symb(arg):
+   if arg.get_type() == 'var':
+      values, types = get_frame(arg)
+      slot = arg.get_slot()
+      value_type = types[slot]
+
+      if value_type is None:
+         print_error(f'Error: undefined variable {arg.get_name()}', ERR_VAR_MISSING)
+      if value_type == '':
+         print_error(f'Error: unset variable value {arg.get_name()}', ERR_VALUE_MISSING)
+
+      # A string which is being built is joined when it's read
+      value = values[slot]
+      if type(value) is StringBuilder:
+         value = values[slot] = value.to_string()
+
+      return value, value_type
+
+   return arg.get_value(), arg.get_type()
+
+# Get the value of a constant or a variable, which must be of the given type
+def get_typed_symb(arg, symb_type, opcode):
+   value, value_type = get_symb(arg)
+   if value_type != symb_type:
+      print_error(f'Error: argument {arg.get_order()} of {opcode} must be of type {symb_type}', ERR_BAD_TYPE)
+
+   return value
+
+# Get the value of a string constant or variable for the string
+# instructions, a string which is being built is not joined
+def get_string_symb(arg, opcode):
+   if arg.get_type() == 'var':
+      values, types = get_frame(arg)
+      value = values[arg.get_slot()]
+      if type(value) is StringBuilder:
+         return value
+
+   return get_typed_symb(arg, 'string', opcode)
+
+# Check if both arguments are the same variable
+def is_same_variable(arg_1, arg_2):
+   return arg_2.get_type() == 'var' and arg_1.get_frame() == arg_2.get_frame() and arg_1.get_name() == arg_2.get_name()
+
+# Get the values of two constants or variables for LT, GT and EQ
+def get_relational_operands(args, opcode):
+   value_1, value_1_type = get_symb(args[1])
+   value_2, value_2_type = get_symb(args[2])
+
+   if value_1_type == 'float' or value_2_type == 'float':
+      print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+
+   check_relational_types(value_1_type, value_2_type, opcode, 'second and third argument')
+   return value_1, value_1_type, value_2, value_2_type
+
+# Check the types of the operands of the relational instructions
+def check_relational_types(value_1_type, value_2_type, opcode, operands):
+
+   # Can compare nils with EQ instruction
+   if (value_1_type == 'nil' or value_2_type == 'nil') and opcode in ['EQ', 'JUMPIFEQ', 'JUMPIFNEQ', 'EQS', 'JUMPIFEQS', 'JUMPIFNEQS']:
+      pass
+   elif value_1_type != value_2_type:
+      print_error(f'Error: {operands} of {opcode} must be of the same type', ERR_BAD_TYPE)
+
+   # Cannot compare nils with LT and GT instructions
+   elif value_1_type == 'nil':
+      print_error('Error: nil can only be compared using the EQ instruction', ERR_BAD_TYPE)
+
+# Compare two values for EQ, JUMPIFEQ and JUMPIFNEQ
+def values_equal(value_1, value_1_type, value_2, value_2_type):
+   if value_1_type == 'nil' or value_2_type == 'nil':
+      return value_1_type == value_2_type
+
+   return value_1 == value_2
+
+# Exit the program after writing out it's output
+def exit_program(code):
+   output.flush()
+   sys.exit(code)
+
+# Value as printed by WRITE, booleans are written as true
+# or false and nil as an empty string
+def format_value(value):
+   if value is True:
+      return 'true'
+   if value is False:
+      return 'false'
+   if value is NIL:
+      return ''
+   return str(value)
+
+# Set the value and type of a variable
+def set_var(arg, value, value_type):
+   values, types = get_frame(arg)
+   slot = arg.get_slot()
+
+   if types[slot] is None:
+      print_error(f'Error: undefined variable {arg.get_name()}', ERR_VAR_MISSING)
+
+   values[slot] = value
+   types[slot] = value_type
+
+def execute_move(args, i):
+   value, value_type = get_symb(args[1])
+   set_var(args[0], value, value_type)
+
+def execute_createframe(args, i):
+   global temporary_frame
 
-      elif opcode == "RETURN":
-         
-         # Get the previous position from the call stack and jump there
-         if len(call_stack) > 0:
-            i = call_stack.pop() # jump
-         else:
-            print_error('Error: call stack empty', ERR_VALUE_MISSING)
+   # Create TF with all variables undefined
+   temporary_frame = ([None] * local_frame_size, [None] * local_frame_size)
 
-      elif opcode == "PUSHS":
-         
-         arg1 = inst.get_args()[0]
+def execute_pushframe(args, i):
+   global temporary_frame
 
-         value = None
-         value_type = None
-
-         # Check types and retrieve the value and type
-         if (arg1.get_type() in ['int', 'string', 'bool', 'nil']):
-            value = arg1.get_value()
-            value_type = arg1.get_type()
-         elif (arg1.get_type() == 'var'):
-            var_frame, var_name = arg1.get_value().split('@')
-            var = Variable(var_name, None, var_frame)
-            value = var.get_value()
-            value_type = var.get_type()
-         else:
-            print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+   # If TF exists, move it to the LF stack, else error
+   if temporary_frame is None:
+      print_error('Error: undefined temporary frame', ERR_FRAME_MISSING)
 
-         # Push the results onto the stack
-         stack.append([value_type, value])
+   local_frames.append(temporary_frame)
+   temporary_frame = None
 
-      elif opcode == "POPS":
-         
-         arg1 = inst.get_args()[0]
+def execute_popframe(args, i):
+   global temporary_frame
 
-         value = None
-         var_type = None
+   if len(local_frames) == 0:
+      print_error('Error: no local frame to be popped', ERR_FRAME_MISSING)
 
-         # Check types
-         if (arg1.get_type() != 'var'):
-            print_error('Error: first argument of MOVE must be of type var', ERR_BAD_TYPE)
+   # Pop the topmost LF into TF
+   temporary_frame = local_frames.pop()
 
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
+def execute_defvar(args, i):
+   values, types = get_frame(args[0])
+   slot = args[0].get_slot()
 
-         # Try to retrieve the value and type from the stack
-         try:
-            value_type, value = stack.pop()
-         except:
-            print_error('Error: empty stack', ERR_VALUE_MISSING)
+   # If variable already exists print an error
+   if types[slot] is not None:
+      print_error(f'Redefinition of variable: {args[0].get_name()}', ERR_SEMANTIC)
 
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type(value_type)
-         var.set()
+   types[slot] = ''
 
-      elif opcode in ["ADD", "SUB", "MUL", "IDIV"]:
-         
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
-         arg3 = inst.get_args()[2]
+def execute_call(args, i):
+   # Add current position to call stack and jump to the label
+   call_stack.append(i)
+   return args[0].get_target()
 
-         value = None
-         value_1 = None
-         value_2 = None
-
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
-
-         if (arg2.get_type() == 'int'):
-            value_1 = arg2.get_value()
-         elif (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            value_1 = var2.get_value()
-            if var2.get_type() != 'int':
-               print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+def execute_return(args, i):
+   # Get the previous position from the call stack and jump after it
+   if len(call_stack) == 0:
+      print_error('Error: call stack empty', ERR_VALUE_MISSING)
 
-         else:
-            print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+   return call_stack.pop() + 1
 
-         if (arg3.get_type() == 'int'):
-            value_2 = arg3.get_value()
-         elif (arg3.get_type() == 'var'):
-            var3_frame, var3_name = arg3.get_value().split('@')
-            var3 = Variable(var3_name, None, var3_frame)
-            value_2 = var3.get_value()
-            if var3.get_type() != 'int':
-               print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+def execute_pushs(args, i):
+   value, value_type = get_symb(args[0])
+   if value_type == 'float':
+      print_error('Error: first argument of PUSHS must be of type symb', ERR_BAD_TYPE)
 
-         else:
-            print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+   stack_values.append(value)
+   stack_types.append(value_type)
 
-         # Check for missing values
-         if value_1 == None or value_2 == None:
-            print_error('Error: missing value', ERR_VALUE_MISSING)
+# PUSHS of a constant, it's value and type are bound instead of the arguments
+def execute_pushs_constant(args, i):
+   stack_values.append(args[0])
+   stack_types.append(args[1])
 
-         # Try to convert values to int
-         try:
-            value_1 = int(value_1)
-            value_2 = int(value_2)
-         except:
-            print_error('Error: wrong integer value', ERR_XML_STRUCT)
+def execute_pops(args, i):
+   if len(stack_types) == 0:
+      print_error('Error: empty stack', ERR_VALUE_MISSING)
 
-         # Calculate the value
-         if opcode == "ADD":
-            value = value_1 + value_2
-         elif opcode == "SUB":
-            value = value_1 - value_2
-         elif opcode == "MUL":
-            value = value_1 * value_2
-         else:
-            if value_2 == 0:
-               print_error('Error: division by 0', ERR_OPERAND_VALUE)
-            value = value_1 // value_2
+   set_var(args[0], stack_values.pop(), stack_types.pop())
 
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
+def execute_add(args, i):
+   value_1 = get_typed_symb(args[1], 'int', 'ADD')
+   value_2 = get_typed_symb(args[2], 'int', 'ADD')
+   set_var(args[0], value_1 + value_2, 'int')
 
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type('int')
-         var.set()
+def execute_sub(args, i):
+   value_1 = get_typed_symb(args[1], 'int', 'SUB')
+   value_2 = get_typed_symb(args[2], 'int', 'SUB')
+   set_var(args[0], value_1 - value_2, 'int')
 
-      elif opcode in ["LT", "GT", "EQ"]:
-         
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
-         arg3 = inst.get_args()[2]
+def execute_mul(args, i):
+   value_1 = get_typed_symb(args[1], 'int', 'MUL')
+   value_2 = get_typed_symb(args[2], 'int', 'MUL')
+   set_var(args[0], value_1 * value_2, 'int')
 
-         value = None
-         value_1 = None
-         value_2 = None
-         value_1_type = None
-         value_2_type = None
-
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
-
-         if (arg2.get_type() in ['int', 'string', 'bool', 'nil']):
-            value_1 = arg2.get_value()
-            value_1_type = arg2.get_type()
-         elif (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            value_1 = var2.get_value()
-            value_1_type = var2.get_type()
-            
-         else:
-            print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+def execute_idiv(args, i):
+   value_1 = get_typed_symb(args[1], 'int', 'IDIV')
+   value_2 = get_typed_symb(args[2], 'int', 'IDIV')
+   if value_2 == 0:
+      print_error('Error: division by 0', ERR_OPERAND_VALUE)
 
-         if (arg3.get_type() in ['int', 'string', 'bool', 'nil']):
-            value_2 = arg3.get_value()
-            value_2_type = arg3.get_type()
-         elif (arg3.get_type() == 'var'):
-            var3_frame, var3_name = arg3.get_value().split('@')
-            var3 = Variable(var3_name, None, var3_frame)
-            value_2 = var3.get_value()
-            value_2_type = var3.get_type()
+   set_var(args[0], value_1 // value_2, 'int')
 
-         else:
-            print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+def execute_lt(args, i):
+   value_1, value_1_type, value_2, value_2_type = get_relational_operands(args, 'LT')
+   set_var(args[0], value_1 < value_2, 'bool')
 
-         # Correct the values of empty strings
-         if value_1 == None and value_1_type == 'string':
-            value_1 = ""
-         
-         if value_2 == None and value_2_type == 'string':
-            value_2 = ""
+def execute_gt(args, i):
+   value_1, value_1_type, value_2, value_2_type = get_relational_operands(args, 'GT')
+   set_var(args[0], value_1 > value_2, 'bool')
 
-         # If they're still none, they have not been set
-         if value_1 == None or value_2 == None:
-            print_error('Error: missing value', ERR_VALUE_MISSING)
+def execute_eq(args, i):
+   operands = get_relational_operands(args, 'EQ')
+   set_var(args[0], values_equal(*operands), 'bool')
 
-         # Can compare nils with EQ instruction
-         if (value_1_type == 'nil' or value_2_type == 'nil') and opcode == 'EQ':
-            pass
-         elif value_1_type != value_2_type:
-            print_error(f'Error: second and third argument of {opcode} must be of the same type', ERR_BAD_TYPE)
-         
-         # Cannot compare nils with LT and GT instructions
-         if (value_1_type == 'nil' or value_2_type == 'nil') and opcode != 'EQ':
-            print_error('Error: nil can only be compared using the EQ instruction', ERR_BAD_TYPE)
-
-         # Calculate the value for each instruction and type combination
-         try:
-            if opcode == "LT":
-               if value_1_type == 'int':
-                  value = bool(int(value_1) < int(value_2))
-               elif value_1_type == 'string':
-                  value_1 = replace_escape_sequences(value_1)
-                  value_2 = replace_escape_sequences(value_2)        
-                  value = bool(value_1 < value_2)
-               else:
-                  if value_1 == 'false' and value_2 == 'true':
-                     value = True
-                  else:
-                     value = False
-            elif opcode == "GT":
-               if value_1_type == 'int':
-                  value = bool(int(value_1) > int(value_2))
-               elif value_1_type == 'string':    
-                  value_1 = replace_escape_sequences(value_1)
-                  value_2 = replace_escape_sequences(value_2)       
-                  value = bool(value_1 > value_2)
-               else:
-                  if value_1 == 'true' and value_2 == 'false':
-                     value = True
-                  else:
-                     value = False
-            elif opcode == "EQ":
-               if value_1_type == 'nil':
-                  if value_2_type == 'nil':
-                     value = True
-                  else:
-                     value = False
-               elif value_2_type == 'nil':
-                  if value_1_type == 'nil':
-                     value = True
-                  else:
-                     value = False
-               elif value_1_type == 'int':
-                  value = bool(int(value_1) == int(value_2))
-               elif value_1_type == 'string':
-                  value_1 = replace_escape_sequences(value_1)
-                  value_2 = replace_escape_sequences(value_2)           
-                  value = bool(value_1 == value_2)
-               else:
-                  if value_1 == value_2:
-                     value = True
-                  else:
-                     value = False
-         except:
-            print_error(f'Error: {opcode} - typeerror', ERR_BAD_TYPE)
-         
-         # In case of booleans, set the actual value
-         if value is True:
-            value = 'true'
-         elif value is False:
-            value = 'false'
-
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
-
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type('bool')
-         var.set()
-
-      elif opcode in ["AND", "OR", "NOT"]:
-         
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
-         if opcode != "NOT":
-            arg3 = inst.get_args()[2]
+def execute_and(args, i):
+   value_1 = get_typed_symb(args[1], 'bool', 'AND')
+   value_2 = get_typed_symb(args[2], 'bool', 'AND')
+   set_var(args[0], value_1 and value_2, 'bool')
 
-         value = None
-         value_1 = None
-         value_2 = None
+def execute_or(args, i):
+   value_1 = get_typed_symb(args[1], 'bool', 'OR')
+   value_2 = get_typed_symb(args[2], 'bool', 'OR')
+   set_var(args[0], value_1 or value_2, 'bool')
 
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
+def execute_not(args, i):
+   value_1 = get_typed_symb(args[1], 'bool', 'NOT')
+   set_var(args[0], not value_1, 'bool')
 
-         if (arg2.get_type() not in ['bool', 'var']):
-            print_error(f'Error: second argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+def execute_int2char(args, i):
+   value_1 = get_typed_symb(args[1], 'int', 'INT2CHAR')
 
-         if (opcode != "NOT") and (arg3.get_type() not in ['bool', 'var']):
-            print_error(f'Error: third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+   # Try to get the actual char value
+   try:
+      value = chr(value_1)
+   except:
+      print_error('Error: INT2CHAR - cannot convert integer to char', ERR_STRING)
 
-         if (arg2.get_type() == 'bool'):
-            value_1 = arg2.get_value()
-         else:
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-
-            if var2.get_type() != 'bool':
-               print_error(f'Error: second argument of {opcode} must be of type symb', ERR_BAD_TYPE)
-
-            value_1 = var2.get_value()
-
-         if (opcode != "NOT"):
-            if (arg3.get_type() == 'bool'):
-               value_2 = arg3.get_value()
-            else:
-               var3_frame, var3_name = arg3.get_value().split('@')
-               var3 = Variable(var3_name, None, var3_frame)
-
-               if var3.get_type() != 'bool':
-                  print_error(f'Error: third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
-
-               value_2 = var3.get_value()
-
-         # Convert 'strings' to booleans
-         if value_1 == 'true':
-            value_1 = True
-         if value_1 == 'false':
-            value_1 = False
-         if value_2 == 'true':
-            value_2 = True
-         if value_2 == 'false':
-            value_2 = False
-
-         # Perform the instruction
-         if opcode == "AND":
-            value = value_1 and value_2
-         elif opcode == "OR":
-            value = value_1 or value_2
-         elif opcode == "NOT":
-            value = not value_1
-
-         # Convert the value back
-         if value is True:
-            value = 'true'
-         else:
-            value = 'false'
+   set_var(args[0], value, 'string')
 
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
+def execute_stri2int(args, i):
+   value_1 = get_typed_symb(args[1], 'string', 'STRI2INT')
+   value_2 = get_typed_symb(args[2], 'int', 'STRI2INT')
 
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type('bool')
-         var.set()
+   # Check value range
+   if value_2 < 0 or value_2 >= len(value_1):
+      print_error('Error: STRI2INT - index out of range', ERR_STRING)
 
-      elif opcode == "INT2CHAR":
-         
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
+   set_var(args[0], ord(value_1[value_2]), 'int')
 
-         value = None
-         value_1 = None
-         value_1_type = None
-
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
-
-         if (arg2.get_type() == 'int'):
-            value_1 = arg2.get_value()
-            value_1_type = arg2.get_type()
-         elif (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            if var2.get_type() != 'int':
-               print_error(f'Error: second argument of {opcode} must be of type int', ERR_BAD_TYPE)
-            value_1 = var2.get_value()
-         else:
-            print_error(f'Error: second argument of {opcode} must be of type int', ERR_BAD_TYPE)
-         
-         # Try to get the actual char value
-         try:
-            value = chr(int(value_1))
-         except:
-            print_error(f'Error: {opcode} - cannot convert integer to char', ERR_STRING)
+# Read the next line of the input as a value of the given type,
+# returns the value and it's type
+def read_input(var_type):
 
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
+   # Read the next line, there is nil after the end of the input
+   line = input_file.read_line()
+   if line is None:
+      var_type = 'nil'
 
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type('string')
-         var.set()
+   # Retrieve the value based on possible types
+   if var_type == 'bool':
+      value = line.upper() == 'TRUE'
 
-      elif opcode == "STRI2INT":
-         
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
-         arg3 = inst.get_args()[2]
+   elif var_type == 'int':
+      try:
+         value = int(line)
+      except:
+         value = NIL
+         var_type = 'nil'
 
-         value = None
-         value_1 = None
-         value_2 = None
-
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
-
-         if (arg2.get_type() == 'string'):
-            value_1 = arg2.get_value()
-         elif (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            if var2.get_type() != 'string':
-               print_error(f'Error: second argument of {opcode} must be of type string', ERR_BAD_TYPE)
-            value_1 = var2.get_value()
-         else:
-            print_error(f'Error: second argument of {opcode} must be of type string', ERR_BAD_TYPE)
-
-         if (arg3.get_type() == 'int'):
-            value_2 = arg3.get_value()
-         elif (arg3.get_type() == 'var'):
-            var3_frame, var3_name = arg3.get_value().split('@')
-            var3 = Variable(var3_name, None, var3_frame)
-            if var3.get_type() != 'int':
-               print_error(f'Error: third argument of {opcode} must be of type int', ERR_BAD_TYPE)
-            value_2 = var3.get_value()
-         else:
-            print_error(f'Error: third argument of {opcode} must be of type int', ERR_BAD_TYPE)
+   elif var_type == 'string':
+      value = line
 
-         # Check value range
-         if int(value_2) < 0:
-            print_error(f'Error: {opcode} - index out of range', ERR_STRING)
+   else:
+      value = NIL
+      var_type = 'nil'
 
-         # Get the integer value
-         try:
-            value = ord(value_1[int(value_2)])
-         except:
-            print_error(f'Error: {opcode} - index out of range', ERR_STRING)
+   return value, var_type
 
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
+def execute_read(args, i):
+   value, value_type = read_input(args[1].get_value())
+   set_var(args[0], value, value_type)
 
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type('int')
-         var.set()
+def execute_write(args, i):
+   value, value_type = get_symb(args[0])
+   output.write(format_value(value))
 
-      elif opcode == "READ":
+def execute_concat(args, i):
+   value_1 = get_typed_symb(args[1], 'string', 'CONCAT')
+   value_2 = get_typed_symb(args[2], 'string', 'CONCAT')
+   set_var(args[0], value_1 + value_2, 'string')
 
-         global read_line_number
-         value = None
-         var_type = None
+# CONCAT with the same variable as the target and the first operand,
+# the string is appended to in place
+def execute_append(args, i):
+   value_1 = get_string_symb(args[1], 'CONCAT')
+   value_2 = get_typed_symb(args[2], 'string', 'CONCAT')
 
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
+   if type(value_1) is not StringBuilder:
+      value_1 = StringBuilder(value_1)
 
-         # Check types
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
+   value_1.append(value_2)
+   set_var(args[0], value_1, 'string')
 
-         if (arg2.get_type() != 'type'):
-            print_error(f'Error: second argument of {opcode} must be of type \'type\'', ERR_BAD_TYPE)
+def execute_strlen(args, i):
+   value_1 = get_string_symb(args[1], 'STRLEN')
+   set_var(args[0], len(value_1), 'int')
 
-         var_type = arg2.get_value()
+def execute_getchar(args, i):
+   value_1 = get_string_symb(args[1], 'GETCHAR')
+   value_2 = get_typed_symb(args[2], 'int', 'GETCHAR')
 
-         # Split the input by '\n' and read one line on index 'read_line_number'
-         input_lines = input_file.split('\n')
-         try:
-            line = input_lines[read_line_number]
-         except:
-            value = 'nil'
-            var_type = 'nil'
-         
-         read_line_number += 1
-         
-         # Retrieve the value based on possible types
-         if var_type == 'bool':
-            if line.upper() == 'TRUE':
-               value = 'true'
-            else:
-               value = 'false'
-
-         elif var_type == 'int':
-            try:
-               value = int(line)
-            except:
-               value = 'nil'
-               var_type = 'nil'
-         
-         elif var_type == 'string':
-            try:
-               value = str(line)
-            except:
-               value = 'nil'
-               var_type = 'nil'
-         else:
-            value = 'nil'
-            var_type = 'nil'
+   # Check value range
+   if value_2 < 0 or value_2 >= len(value_1):
+      print_error('Error: GETCHAR - index out of range', ERR_STRING)
 
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
+   set_var(args[0], value_1[value_2], 'string')
 
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type(var_type)
-         var.set()         
+def execute_setchar(args, i):
+   value = get_string_symb(args[0], 'SETCHAR')
+   value_1 = get_typed_symb(args[1], 'int', 'SETCHAR')
+   value_2 = get_typed_symb(args[2], 'string', 'SETCHAR')
 
-      elif opcode == "WRITE":
-         
-         arg1 = inst.get_args()[0]
+   # Check value range
+   if value_1 < 0 or value_1 >= len(value) or value_2 == '':
+      print_error('Error: SETCHAR - index out of range', ERR_STRING)
 
-         # Check types and retrieve the value and type
-         if (arg1.get_type() in ['int', 'bool', 'string', 'float', 'nil']):
-            value = arg1.get_value()
-            typ = arg1.get_type()
+   # The character is changed in place
+   if type(value) is not StringBuilder:
+      value = StringBuilder(value)
 
-         elif (arg1.get_type() == 'var'):
-            var_frame, var_name = arg1.get_value().split('@')
-            var = Variable(var_name, None, var_frame)
-            value = var.get_value()
-            typ = var.get_type()
+   value.set_char(value_1, value_2[0])
+   set_var(args[0], value, 'string')
 
-         else:
-            print_error('Error: second argument of MOVE must be of type symb', ERR_XML_STRUCT)
+def execute_type(args, i):
+   arg2 = args[1]
 
-         value = replace_escape_sequences(str(value))
+   # Uninitialized variable has an empty type
+   if arg2.get_type() == 'var':
+      values, types = get_frame(arg2)
+      value = types[arg2.get_slot()]
+      if value is None:
+         print_error(f'Error: undefined variable {arg2.get_name()}', ERR_VAR_MISSING)
+   else:
+      value = arg2.get_type()
 
-         # Change the value if it's 'nil'
-         if value == 'nil' and typ != 'string':
-            value = ""
-         print(value, end='')
+   set_var(args[0], value, 'string')
 
-      elif opcode == "CONCAT":
+def execute_jump(args, i):
+   return args[0].get_target()
+
+def execute_jumpifeq(args, i):
+   operands = get_relational_operands(args, 'JUMPIFEQ')
 
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
-         arg3 = inst.get_args()[2]
+   # If the condition is true, jump
+   if values_equal(*operands):
+      return args[0].get_target()
 
-         value = None
-         value_1 = None
-         value_2 = None
+def execute_jumpifneq(args, i):
+   operands = get_relational_operands(args, 'JUMPIFNEQ')
 
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
+   # If the condition is false, jump
+   if not values_equal(*operands):
+      return args[0].get_target()
 
-         if (arg2.get_type() not in ['string', 'var']):
-            print_error(f'Error: second argument of {opcode} must be of type string', ERR_BAD_TYPE)
+def execute_exit(args, i):
+   value = get_typed_symb(args[0], 'int', 'EXIT')
 
-         if (arg2.get_type() == 'string'):
-            value_1 = arg2.get_value()
-            value_1_type = arg2.get_type()
-         else:
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
+   # Check value range
+   if value < 0 or value > 49:
+      print_error('Error: EXIT - invalid error value', ERR_OPERAND_VALUE)
 
-            if var2.get_type() != 'string':
-               print_error(f'Error: second argument of {opcode} must be of type string', ERR_BAD_TYPE)
+   # Exit with the given value
+   exit_program(value)
+
+# The stack instructions take their operands from the data stack, the
+# last operand is on the top. The result replaces the first operand, so
+# the binary instructions only pop the second one.
+
+# Pop the second operand of a stack instruction, both operands must be
+# of the given type
+def pop_typed_operand(operand_type, opcode):
+   if len(stack_types) < 2:
+      print_error(f'Error: {opcode} - not enough values on the stack', ERR_VALUE_MISSING)
+   if stack_types[-1] != operand_type or stack_types[-2] != operand_type:
+      print_error(f'Error: operands of {opcode} must be of type {operand_type}', ERR_BAD_TYPE)
+
+   stack_types.pop()
+   return stack_values.pop()
+
+# Pop the operands of LTS, GTS, EQS, JUMPIFEQS and JUMPIFNEQS with their
+# types, the first operand is left on the stack for the result
+def pop_relational_operands(opcode):
+   if len(stack_types) < 2:
+      print_error(f'Error: {opcode} - not enough values on the stack', ERR_VALUE_MISSING)
+   check_relational_types(stack_types[-2], stack_types[-1], opcode, 'operands')
 
-            value_1 = var2.get_value()
-            value_1_type = var2.get_type()
+   value_2 = stack_values.pop()
+   value_2_type = stack_types.pop()
+   return stack_values[-1], stack_types[-1], value_2, value_2_type
 
-         if (arg3.get_type() not in ['string', 'var']):
-            print_error(f'Error: third argument of {opcode} must be of type string', ERR_BAD_TYPE)
+def execute_clears(args, i):
+   stack_values.clear()
+   stack_types.clear()
+
+def execute_adds(args, i):
+   value_2 = pop_typed_operand('int', 'ADDS')
+   stack_values[-1] += value_2
+
+def execute_subs(args, i):
+   value_2 = pop_typed_operand('int', 'SUBS')
+   stack_values[-1] -= value_2
+
+def execute_muls(args, i):
+   value_2 = pop_typed_operand('int', 'MULS')
+   stack_values[-1] *= value_2
+
+def execute_idivs(args, i):
+   value_2 = pop_typed_operand('int', 'IDIVS')
+   if value_2 == 0:
+      print_error('Error: division by 0', ERR_OPERAND_VALUE)
+
+   stack_values[-1] //= value_2
+
+def execute_lts(args, i):
+   value_1, value_1_type, value_2, value_2_type = pop_relational_operands('LTS')
+   stack_values[-1] = value_1 < value_2
+   stack_types[-1] = 'bool'
+
+def execute_gts(args, i):
+   value_1, value_1_type, value_2, value_2_type = pop_relational_operands('GTS')
+   stack_values[-1] = value_1 > value_2
+   stack_types[-1] = 'bool'
+
+def execute_eqs(args, i):
+   operands = pop_relational_operands('EQS')
+   stack_values[-1] = values_equal(*operands)
+   stack_types[-1] = 'bool'
+
+def execute_ands(args, i):
+   value_2 = pop_typed_operand('bool', 'ANDS')
+   stack_values[-1] = stack_values[-1] and value_2
+
+def execute_ors(args, i):
+   value_2 = pop_typed_operand('bool', 'ORS')
+   stack_values[-1] = stack_values[-1] or value_2
+
+def execute_nots(args, i):
+   if len(stack_types) == 0:
+      print_error('Error: NOTS - not enough values on the stack', ERR_VALUE_MISSING)
+   if stack_types[-1] != 'bool':
+      print_error('Error: operand of NOTS must be of type bool', ERR_BAD_TYPE)
+
+   stack_values[-1] = not stack_values[-1]
+
+def execute_int2chars(args, i):
+   if len(stack_types) == 0:
+      print_error('Error: INT2CHARS - not enough values on the stack', ERR_VALUE_MISSING)
+   if stack_types[-1] != 'int':
+      print_error('Error: operand of INT2CHARS must be of type int', ERR_BAD_TYPE)
+
+   # Try to get the actual char value
+   try:
+      stack_values[-1] = chr(stack_values[-1])
+   except (ValueError, OverflowError):
+      print_error('Error: INT2CHARS - cannot convert integer to char', ERR_STRING)
+
+   stack_types[-1] = 'string'
+
+def execute_stri2ints(args, i):
+   if len(stack_types) < 2:
+      print_error('Error: STRI2INTS - not enough values on the stack', ERR_VALUE_MISSING)
+   if stack_types[-2] != 'string' or stack_types[-1] != 'int':
+      print_error('Error: operands of STRI2INTS must be of type string and int', ERR_BAD_TYPE)
+
+   stack_types.pop()
+   value_2 = stack_values.pop()
+   value_1 = stack_values[-1]
+
+   # Check value range
+   if value_2 < 0 or value_2 >= len(value_1):
+      print_error('Error: STRI2INTS - index out of range', ERR_STRING)
+
+   stack_values[-1] = ord(value_1[value_2])
+   stack_types[-1] = 'int'
+
+def execute_jumpifeqs(args, i):
+   operands = pop_relational_operands('JUMPIFEQS')
+   stack_values.pop()
+   stack_types.pop()
+
+   # If the condition is true, jump
+   if values_equal(*operands):
+      return args[0].get_target()
+
+def execute_jumpifneqs(args, i):
+   operands = pop_relational_operands('JUMPIFNEQS')
+   stack_values.pop()
+   stack_types.pop()
+
+   # If the condition is false, jump
+   if not values_equal(*operands):
+      return args[0].get_target()
+
+# LABEL is dealt with before the interpretation, DPRINT and BREAK
+# are just acknowledged and the float instructions are not supported
+def execute_nothing(args, i):
+   pass
+
+# Handler of each instruction
+opcode_handlers = {
+   'MOVE': execute_move,
+   'CREATEFRAME': execute_createframe,
+   'PUSHFRAME': execute_pushframe,
+   'POPFRAME': execute_popframe,
+   'DEFVAR': execute_defvar,
+   'CALL': execute_call,
+   'RETURN': execute_return,
+   'PUSHS': execute_pushs,
+   'POPS': execute_pops,
+   'ADD': execute_add,
+   'SUB': execute_sub,
+   'MUL': execute_mul,
+   'IDIV': execute_idiv,
+   'LT': execute_lt,
+   'GT': execute_gt,
+   'EQ': execute_eq,
+   'AND': execute_and,
+   'OR': execute_or,
+   'NOT': execute_not,
+   'INT2CHAR': execute_int2char,
+   'STRI2INT': execute_stri2int,
+   'READ': execute_read,
+   'WRITE': execute_write,
+   'CONCAT': execute_concat,
+   'STRLEN': execute_strlen,
+   'GETCHAR': execute_getchar,
+   'SETCHAR': execute_setchar,
+   'TYPE': execute_type,
+   'LABEL': execute_nothing,
+   'JUMP': execute_jump,
+   'JUMPIFEQ': execute_jumpifeq,
+   'JUMPIFNEQ': execute_jumpifneq,
+   'EXIT': execute_exit,
+   'DPRINT': execute_nothing,
+   'BREAK': execute_nothing,
+   'CLEARS': execute_clears,
+   'ADDS': execute_adds,
+   'SUBS': execute_subs,
+   'MULS': execute_muls,
+   'IDIVS': execute_idivs,
+   'LTS': execute_lts,
+   'GTS': execute_gts,
+   'EQS': execute_eqs,
+   'ANDS': execute_ands,
+   'ORS': execute_ors,
+   'NOTS': execute_nots,
+   'INT2CHARS': execute_int2chars,
+   'STRI2INTS': execute_stri2ints,
+   'JUMPIFEQS': execute_jumpifeqs,
+   'JUMPIFNEQS': execute_jumpifneqs,
+   'INT2FLOAT': execute_nothing,
+   'FLOAT2INT': execute_nothing
+}
+
+# Bind each instruction to it's handler
+def bind_handlers(program):
+   code = []
+   for i in range(len(program)):
+      handler = opcode_handlers[program.get_opcode(i)]
+      args = program.get_args(i)
+
+      # CONCAT appending to it's first operand
+      if handler is execute_concat and is_same_variable(args[0], args[1]):
+         handler = execute_append
+
+      # PUSHS of a constant, a float still fails when it's executed
+      elif handler is execute_pushs and args[0].get_type() not in ('var', 'float'):
+         handler = execute_pushs_constant
+         args = (args[0].get_value(), args[0].get_type())
+
+      code.append((handler, args))
+
+   return code
+
+# Superinstructions run a common sequence of instructions in a single
+# dispatch, they get the arguments of all instructions of the sequence.
+# The other instructions of the sequence stay in the program, so that
+# jumps into the middle of the sequence still work.
+
+def execute_createframe_pushframe_call(args, i):
+   execute_createframe(args[0], i)
+   execute_pushframe(args[1], i + 1)
+   return execute_call(args[2], i + 2)
+
+def execute_pushframe_call(args, i):
+   execute_pushframe(args[0], i)
+   return execute_call(args[1], i + 1)
+
+def execute_add_jumpifneq(args, i):
+   execute_add(args[0], i)
+   target = execute_jumpifneq(args[1], i + 1)
+
+   # Continue after the sequence if the jump is not taken
+   if target is None:
+      return i + 2
+   return target
+
+def execute_defvar_move(args, i):
+   execute_defvar(args[0], i)
+   execute_move(args[1], i + 1)
+   return i + 2
+
+# A run of bound instructions, which never jump
+def execute_run(args, i):
+   for handler, handler_args in args:
+      handler(handler_args, i)
+   return i + len(args)
+
+# Sequences replaced by superinstructions, the longer ones first
+superinstructions = [
+   (('CREATEFRAME', 'PUSHFRAME', 'CALL'), execute_createframe_pushframe_call),
+   (('PUSHFRAME', 'CALL'), execute_pushframe_call),
+   (('ADD', 'JUMPIFNEQ'), execute_add_jumpifneq),
+   (('DEFVAR', 'MOVE'), execute_defvar_move)
+]
 
-         if (arg3.get_type() == 'string'):
-            value_2 = arg3.get_value()
-            value_2_type = arg3.get_type()
-         else:
-            var3_frame, var3_name = arg3.get_value().split('@')
-            var3 = Variable(var3_name, None, var3_frame)
+# Stack instructions which never jump
+stack_opcodes = {'PUSHS', 'POPS', 'CLEARS', 'ADDS', 'SUBS', 'MULS', 'IDIVS', 'LTS', 'GTS', 'EQS', 'ANDS', 'ORS', 'NOTS', 'INT2CHARS', 'STRI2INTS'}
 
-            if var3.get_type() != 'string':
-               print_error(f'Error: third argument of {opcode} must be of type string', ERR_BAD_TYPE)
+# Replace the common sequences of bound instructions by superinstructions
+def fuse_instructions(program, code):
 
-            value_2 = var3.get_value()
-            value_2_type = var3.get_type()
+   opcodes = [program.get_opcode(i) for i in range(len(program))]
+   fused = list(code)
 
-         # Correct the values of empty strings
-         if value_1 == None and value_1_type == 'string':
-            value_1 = ""
-         if value_2 == None and value_2_type == 'string':
-            value_2 = ""   
+   for i in range(len(program)):
+      for sequence, handler in superinstructions:
+         if opcodes[i] == sequence[0] and tuple(opcodes[i:i + len(sequence)]) == sequence:
+            fused[i] = (handler, tuple(args for _, args in code[i:i + len(sequence)]))
+            break
 
-         value = str(value_1) + str(value_2)
+      # A run of CONCAT instructions into the same variable
+      if opcodes[i] == 'CONCAT':
+         target = program.get_args(i)[0]
+         end = i + 1
+         while end < len(program) and opcodes[end] == 'CONCAT':
+            if not is_same_variable(target, program.get_args(end)[0]):
+               break
+            end += 1
+
+         if end - i > 1:
+            fused[i] = (execute_run, tuple(code[i:end]))
+
+      # A run of stack instructions, they can only be jumped to at the
+      # start of the run, after a label or a call
+      if opcodes[i] in stack_opcodes and (i == 0 or opcodes[i - 1] not in stack_opcodes):
+         end = i + 1
+         while end < len(program) and opcodes[end] in stack_opcodes:
+            end += 1
+
+         if end - i > 1:
+            fused[i] = (execute_run, tuple(code[i:end]))
+
+   return fused
+
+################################ COMPILATION ################################
+
+# The compiled program is a function of a Python module, which gets these
+# helpers as arguments. Values of the compiled programs are the same as the
+# values of the interpretation, but without the type, which is known from
+# the type of the value.
+
+# Report an undefined or unset variable
+def report_missing(value, name):
+   if value is UNDEFINED:
+      print_error(f'Error: undefined variable {name}', ERR_VAR_MISSING)
+
+   print_error(f'Error: unset variable value {name}', ERR_VALUE_MISSING)
+
+def read_value(var_type):
+   value, value_type = read_input(var_type)
+   return value
+
+# Name of the type as returned by TYPE, empty for unset variables
+def type_name(value):
+   if value is UNSET:
+      return ''
+   if value is NIL:
+      return 'nil'
+   return {int: 'int', bool: 'bool', str: 'string'}[type(value)]
 
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
+# Whether the directory belongs to this user and nobody else can access
+# it, the files in it then cannot be changed by the others
+def is_private_directory(directory):
+   if not hasattr(os, 'getuid'):
+      return False
 
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type('string')
-         var.set()
-         
-      elif opcode == "STRLEN":
-         
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
+   try:
+      status = os.stat(directory)
+   except OSError:
+      return False
 
-         value = None
-         value_1 = None
-
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
-
-         if (arg2.get_type() == 'string'):
-            value_1 = arg2.get_value()
-         elif (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            if var2.get_type() != 'string':
-               print_error(f'Error: second argument of {opcode} must be of type string', ERR_BAD_TYPE)
-            value_1 = var2.get_value()
-         else:
-            print_error(f'Error: second argument of {opcode} must be of type string', ERR_BAD_TYPE)
+   return os.path.isdir(directory) and status.st_uid == os.getuid() and status.st_mode & 0o077 == 0
 
-         # Strlen of empty string is 0
-         if value_1 == None:
-            value = 0
-         else:
-            value = len(replace_escape_sequences(value_1))
-
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
-
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type('int')
-         var.set()
-
-      elif opcode == "GETCHAR":
-
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
-         arg3 = inst.get_args()[2]
-
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
-
-         if (arg2.get_type() == 'string'):
-            value_1 = arg2.get_value()
-         elif (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            if var2.get_type() != 'string':
-               print_error(f'Error: second argument of {opcode} must be of type string', ERR_BAD_TYPE)
-            value_1 = var2.get_value()
-         else:
-            print_error(f'Error: second argument of {opcode} must be of type string', ERR_BAD_TYPE)
-
-         if (arg3.get_type() == 'int'):
-            value_2 = arg3.get_value()
-         elif (arg3.get_type() == 'var'):
-            var3_frame, var3_name = arg3.get_value().split('@')
-            var3 = Variable(var3_name, None, var3_frame)
-            if var3.get_type() != 'int':
-               print_error(f'Error: third argument of {opcode} must be of type int', ERR_BAD_TYPE)
-            value_2 = var3.get_value()
-         else:
-            print_error(f'Error: third argument of {opcode} must be of type int', ERR_BAD_TYPE)
-         
-         # Check value range
-         if int(value_2) < 0:
-            print_error(f'Error: {opcode} - index out of range', ERR_STRING)
-         
-         # Try to get the actual value
-         try:
-            value = value_1[int(value_2)]
-         except:
-            print_error(f'Error: {opcode} - index out of range', ERR_STRING)
+# Load the compiled program saved as KEY.py in the cache directory,
+# returns None if there is none or it belongs to another key
+def load_compiled_program(path, key):
 
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
+   try:
+      with open(path, 'rb') as compiled_file:
+         compiled_file.readline()
+         key_line = compiled_file.readline()
+   except OSError:
+      return None
 
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type('string')
-         var.set()
+   if key_line.strip() != f'# Key: {key}'.encode():
+      return None
 
-      elif opcode == "SETCHAR":
-         
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
-         arg3 = inst.get_args()[2]
+   # Importing the module uses and keeps the bytecode in __pycache__
+   try:
+      spec = importlib.util.spec_from_file_location('ippcode23_program', path)
+      module = importlib.util.module_from_spec(spec)
+      spec.loader.exec_module(module)
+   except (OSError, SyntaxError, ImportError):
+      return None
 
-         value = None
-         value_1 = None
-         value_2 = None
-
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
-         
-         var1_frame, var1_name = arg1.get_value().split('@')
-         var1 = Variable(var1_name, None, var1_frame)
-         if var1.get_type() != 'string':
-            print_error(f'Error: first argument of {opcode} must be of type string', ERR_BAD_TYPE)
-         
-
-         if (arg2.get_type() == 'int'):
-            value_1 = arg2.get_value()
-         elif (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            if var2.get_value_unset() == None:
-               print_error(f'Error: {opcode} - missing value', ERR_VALUE_MISSING)
-            if var2.get_type() != 'int':
-               print_error(f'Error: second argument of {opcode} must be of type int', ERR_BAD_TYPE)
-            value_1 = var2.get_value()
-         else:
-            print_error(f'Error: second argument of {opcode} must be of type int', ERR_BAD_TYPE)
-
-         if (arg3.get_type() == 'string'):
-            value_2 = arg3.get_value()
-         elif (arg3.get_type() == 'var'):
-            var3_frame, var3_name = arg3.get_value().split('@')
-            var3 = Variable(var3_name, None, var3_frame)
-            if var3.get_value_unset() == None:
-               print_error(f'Error: {opcode} - missing value', ERR_VALUE_MISSING)
-            if var3.get_type() != 'string':
-               print_error(f'Error: third argument of {opcode} must be of type string', ERR_BAD_TYPE)
-            value_2 = var3.get_value()
-         else:
-            print_error(f'Error: third argument of {opcode} must be of type string', ERR_BAD_TYPE)
+   return getattr(module, 'program', None)
 
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
+# Translate the program to Python and compile it, when the path is
+# given the module is also saved there together with it's bytecode
+def compile_program(program, labels, key, path):
 
-         var_tmp = Variable(var_name, value, var_frame)
-         value = var_tmp.get_value()
-         
-         # Check value range
-         if int(value_1) < 0 or int(value_1) >= len(value):
-            print_error(f'Error: {opcode} - index out of range', ERR_STRING)
+   source = Transpiler(program, labels).translate(key)
 
-         value = replace_escape_sequences(value)
-         value_2 = replace_escape_sequences(value_2)
+   if path is not None:
+      try:
+         tmp_path = f'{path}.{os.getpid()}.tmp'
+         with open(tmp_path, 'w') as compiled_file:
+            compiled_file.write(source)
+         os.replace(tmp_path, path)
+
+         # Hash based bytecode is checked against the source,
+         # not against the time of the last modification
+         py_compile.compile(path, doraise=True, invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+      except (OSError, py_compile.PyCompileError):
+         pass
 
-         # Try to get the actual value
-         try:
-            value = value[:int(value_1)] + value_2[0] + value[int(value_1)+1:]
-         except:
-            print_error(f'Error: {opcode} - index out of range', ERR_STRING)
+      compiled = load_compiled_program(path, key)
+      if compiled is not None:
+         return compiled
 
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type('string')
-         var.set()
+   namespace = {}
+   exec(compile(source, '<ippcode23>', 'exec'), namespace)
+   return namespace['program']
 
-      elif opcode == "TYPE":
-        
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
+def run_compiled_program(compiled):
+   compiled(print_error, report_missing, read_value, output.write, format_value, type_name, exit_program, NIL, UNDEFINED, UNSET)
 
-         value = None
+################################## BATCH ####################################
 
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'var'):
-            print_error(f'Error: first argument of {opcode} must be of type var', ERR_BAD_TYPE)
-
-         if (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            if var2.get_value_unset() == None:
-               value = ""
-            else:
-               value = var2.get_type_unset()
-            
-         else:
-            value = arg2.get_type()
+# The batch runs many tests in a pool of processes, each process runs one
+# test after another, so the interpret is started only once per process.
+# A test is a source NAME.src with the optional input NAME.in, expected
+# output NAME.out and expected exit code NAME.rc, the missing files are
+# empty and the exit code is 0. The output is only compared when the
+# expected exit code is 0.
 
-         # Get the var frame and var name
-         var_frame, var_name = arg1.get_value().split('@')
+# Reset the state of the interpretation, so that another program can
+# be run in the same process
+def reset_state():
+   global instructions
+   global labels
+   global global_frame
+   global local_frame_size
 
-         # Create a new Variable object and try to set it's value
-         var = Variable(var_name, value, var_frame)
-         var.set_type('string')
-         var.set()
+   instructions = None
+   labels = {}
+   global_frame = ([], [])
+   local_frame_size = 0
+   reset_frames()
+
+# Clear the frames and the stacks, so that the loaded program can be run
+# again, the slots stay the same
+def reset_frames():
+   global input_file
+   global output
+   global global_frame
+   global local_frames
+   global temporary_frame
 
-      elif opcode == "LABEL":
-         # LABEL are already dealt with at the beginning
-         pass
+   input_file = None
+   output = None
+   global_frame = ([None] * len(global_frame[0]), [None] * len(global_frame[0]))
+   local_frames = []
+   temporary_frame = None
+
+   stack_values.clear()
+   stack_types.clear()
+   call_stack.clear()
+
+# Names of the tests in the directory and it's subdirectories, without
+# the extension
+def find_tests(directory):
+   tests = []
+   for root, dirs, files in os.walk(directory):
+      for file_name in files:
+         if file_name.endswith('.src'):
+            tests.append(os.path.join(root, file_name[:-4]))
+
+   return sorted(tests)
+
+# Read the file of the test, the default is used if it does not exist
+def read_test_file(path, default, binary=False):
+   try:
+      with open(path, 'rb' if binary else 'r') as test_file:
+         return test_file.read()
+   except FileNotFoundError:
+      return default
+
+# Run the function with the error output written to the string stream,
+# returns the exit code if the program ended by an error or EXIT, otherwise
+# None
+def capture_exit(function, stderr):
+   with contextlib.redirect_stderr(stderr):
+      try:
+         function()
+      except SystemExit as exit_error:
+         return exit_error.code
+      except InterpretError as error:
+         stderr.write(f'{error}\n')
+         return error.code
+      except Exception as error:
+         stderr.write(f'Error: {error!r}\n')
+         return ERR_INTERNAL
+
+   return None
+
+# Run the function with the input for READ and the output written to the
+# binary stream, returns the exit code and the error output
+def run_captured(function, program_input, stdout):
+   global input_file
+   global output
+
+   reset_frames()
+   stderr = io.StringIO()
+   output = OutputWriter(stdout, 'utf-8', 'strict', 'block')
+   input_file = program_input
+
+   code = capture_exit(function, stderr)
+   if code is None:
+      output.flush()
+      code = ERR_OK
+
+   return code, stderr.getvalue()
+
+# Run a program in this process with the input for READ, the source file
+# is read by the loader, returns the exit code, the output and the error
+# output
+def run_in_process(source_file, loader, program_input):
+
+   def run_program():
+      global instructions
+      global labels
+
+      instructions = loader(source_file)
+      labels = find_labels(instructions)
+      link_labels(instructions, labels)
+      assign_slots(instructions)
+      interpret_program(instructions)
+
+   reset_state()
+   stdout = io.BytesIO()
+   code, stderr = run_captured(run_program, program_input, stdout)
+   return code, stdout.getvalue(), stderr
+
+def raise_timeout(signum, frame):
+   raise TestTimeout()
+
+# Run one test in this process with the time limit, returns the name, the
+# exit code, None if the test timed out, the expected exit code, whether
+# it passed, the time and the error message
+def run_test(task):
+   test, timeout = task
+
+   # A test with a wrong expected exit code fails without running
+   try:
+      expected_code = int(read_test_file(test + '.rc', '0').strip() or 0)
+   except ValueError:
+      return test, None, None, False, 0.0, 'wrong exit code in the .rc file'
+   expected_output = read_test_file(test + '.out', b'', True)
+   input_text = read_test_file(test + '.in', '')
+
+   # The timer interrupts the test, where it's supported
+   timer = timeout > 0 and hasattr(signal, 'setitimer')
+   if timer:
+      signal.signal(signal.SIGALRM, raise_timeout)
+
+   start = time.perf_counter()
+   try:
+      with open(test + '.src', 'rb') as source_file:
+         if timer:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+         try:
+            code, stdout, stderr = run_in_process(source_file, load_program, LineCursor(input_text))
+         finally:
+            if timer:
+               signal.setitimer(signal.ITIMER_REAL, 0)
+   except TestTimeout:
+      code, stdout, stderr = None, b'', ''
+   elapsed = time.perf_counter() - start
+
+   passed = code == expected_code and (expected_code != ERR_OK or stdout == expected_output)
+   message = stderr.strip().split('\n')[0]
+   return test, code, expected_code, passed, elapsed, message
+
+# Run all tests of the directory and write the report
+def run_batch(directory, jobs, timeout):
+   tasks = [(test, timeout) for test in find_tests(directory)]
+
+   start = time.perf_counter()
+   if jobs == 1:
+      results = [run_test(task) for task in tasks]
+   else:
+      with multiprocessing.Pool(jobs) as pool:
+         results = list(pool.imap_unordered(run_test, tasks))
+   wall_time = time.perf_counter() - start
+
+   # One line for each test in the order of their names
+   report = []
+   for test, code, expected_code, passed, elapsed, message in sorted(results):
+      line = f"{'PASS' if passed else 'FAIL'} {elapsed * 1000:10.2f} ms  {os.path.relpath(test, directory)}"
+      if expected_code is None:
+         line += f'  ({message})'
+      elif code is None:
+         line += f'  (timed out after {timeout:g} s)'
+      elif code != expected_code:
+         line += f'  (exit code {code}, expected {expected_code})'
+         if message:
+            line += f': {message}'
+      elif not passed:
+         line += '  (output differs)'
+      report.append(line)
+
+   passed_count = sum(1 for result in results if result[3])
+   test_time = sum(result[4] for result in results)
+   report.append(f'{passed_count} of {len(results)} tests passed in {wall_time:.2f} s with {jobs} jobs, {test_time:.2f} s in the tests')
+   sys.stdout.write('\n'.join(report) + '\n')
+   sys.stdout.flush()
+
+   return passed_count == len(results)
+
+# With --inputs-from, the program is loaded once and the processes are
+# forked after that, so they share the loaded program until they change
+# it's memory. The output of the Nth input of the list is written to N.out
+# in the results directory, the error output to N.err if there is any,
+# and the manifest has a line with the exit code, the output file and the
+# input file for each input, in the order of the list.
+
+# Run the loaded program for the Nth input, returns N, the exit code and
+# whether there is an error output
+def run_input(task):
+   index, input_name, results_dir = task
 
-      elif opcode == "JUMP":
-         
-         arg1 = inst.get_args()[0]
+   try:
+      program_input = MappedInput(input_name)
+   except ValueError:
+      program_input = LineCursor('')
+   except OSError:
+      program_input = None
+
+   with open(os.path.join(results_dir, f'{index}.out'), 'wb') as stdout:
+      if program_input is None:
+         code, stderr = ERR_IN_FILE, 'Error: cannot open the input file\n'
+      else:
+         code, stderr = run_captured(loaded_program, program_input, stdout)
 
-         # Check type
-         if (arg1.get_type() != 'label'):
-            print_error(f'Error: first argument of {opcode} must be of type label', ERR_BAD_TYPE)
+   error_name = os.path.join(results_dir, f'{index}.err')
+   if stderr:
+      with open(error_name, 'w') as error_file:
+         error_file.write(stderr)
+   elif os.path.exists(error_name):
+      os.unlink(error_name)
 
-         # Find the label index and jump
-         label_name = arg1.get_value()
-         if label_name in labels:
-            i = labels[label_name] # jump
-         else:
-            print_error('Error: undefined label', ERR_SEMANTIC)
-
-      elif opcode == "JUMPIFEQ":
-         
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
-         arg3 = inst.get_args()[2]
-
-         # Check if label exists
-         if arg1.get_value() not in labels:
-            print_error('Error: undefined label', ERR_SEMANTIC)
-
-         # Default is false
-         value = False
-
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'label'):
-            print_error(f'Error: first argument of {opcode} must be of type label', ERR_BAD_TYPE)
-
-         if (arg2.get_type() in ['int', 'string', 'bool', 'nil']):
-            value_1 = arg2.get_value()
-            value_1_type = arg2.get_type()
-         elif (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            value_1 = var2.get_value()
-            value_1_type = var2.get_type()
-            
-         else:
-            print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+   return index, code
 
-         if (arg3.get_type() in ['int', 'string', 'bool', 'nil']):
-            value_2 = arg3.get_value()
-            value_2_type = arg3.get_type()
-         elif (arg3.get_type() == 'var'):
-            var3_frame, var3_name = arg3.get_value().split('@')
-            var3 = Variable(var3_name, None, var3_frame)
-            value_2 = var3.get_value()
-            value_2_type = var3.get_type()
+# Run the loaded program for each input listed in the file and write the
+# manifest
+def run_inputs(list_name, results_dir, jobs):
+   try:
+      with open(list_name) as list_file:
+         input_names = [line.rstrip('\r\n') for line in list_file if line.strip()]
+   except OSError:
+      print_error('Error: cannot open the list of the inputs', ERR_IN_FILE)
 
-         else:
-            print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+   if results_dir is None:
+      results_dir = list_name + '.results'
+   try:
+      os.makedirs(results_dir, exist_ok=True)
+   except OSError:
+      print_error('Error: cannot create the results directory', ERR_OUT_FILE)
+
+   tasks = [(index, input_name, results_dir) for index, input_name in enumerate(input_names, 1)]
+
+   # The forked processes need the loaded program, the objects which exist
+   # now are left out of the garbage collection, so it does not write to
+   # their memory
+   if jobs == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+      results = [run_input(task) for task in tasks]
+   else:
+      gc.freeze()
+      try:
+         with multiprocessing.get_context('fork').Pool(jobs) as pool:
+            results = list(pool.imap_unordered(run_input, tasks, chunksize=16))
+      finally:
+         gc.unfreeze()
+
+   codes = dict(results)
+   with open(os.path.join(results_dir, 'manifest'), 'w') as manifest:
+      for index, input_name in enumerate(input_names, 1):
+         manifest.write(f'{codes[index]}\t{index}.out\t{input_name}\n')
+
+################################## SERVER ###################################
+
+# The server keeps warm interpret processes, which run the programs sent
+# by interpret_client.py over a Unix socket. The processes are forked
+# before the first request and all of them accept the connections of the
+# same socket, one connection is one program. Each message is it's length
+# in 8 bytes followed by the data in marshal format. The request is a dict
+# with the source, it's format ('xml' or 'text') and the data of the input
+# file. Without an input file, the standard input of the client follows the
+# request and it's lines are read by READ. The response is a tuple of the
+# output, the error output and the exit code.
+
+def send_message(connection, data):
+   connection.sendall(len(data).to_bytes(8, 'big') + data)
+
+def receive_message(connection):
+   size = int.from_bytes(receive_bytes(connection, 8), 'big')
+   return receive_bytes(connection, size)
+
+# Receive exactly the given number of bytes
+def receive_bytes(connection, size):
+   chunks = []
+   while size > 0:
+      chunk = connection.recv(min(size, 1 << 20))
+      if not chunk:
+         raise EOFError('connection closed')
+      chunks.append(chunk)
+      size -= len(chunk)
+
+   return b''.join(chunks)
+
+def get_request_loader(request):
+   return load_source_text if request['format'] == 'text' else load_program
+
+# Decode the input file of the request like the input file of
+# interpret.py, the new lines are translated
+def get_request_input(request):
+   encoding = locale.getpreferredencoding(False)
+   return LineCursor(io.TextIOWrapper(io.BytesIO(request['input']), encoding).read())
+
+# Run the program of the request, returns the response
+def run_request(request, connection):
+
+   # The standard input is not translated
+   if request['input'] is not None:
+      program_input = get_request_input(request)
+   else:
+      encoding = locale.getpreferredencoding(False)
+      program_input = LineReader(io.TextIOWrapper(connection.makefile('rb'), encoding, newline='\n'))
+
+   code, stdout, stderr = run_in_process(io.BytesIO(request['source']), get_request_loader(request), program_input)
+   return stdout, stderr.encode(), code
+
+# Accept the connections in a forked process, it never returns. With the
+# slice size, the programs of the connections are run together by the
+# scheduler.
+def serve_connections(server, slice_size):
+   signal.signal(signal.SIGTERM, signal.SIG_DFL)
+   signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+   try:
+      if slice_size is not None:
+         asyncio.run(serve_async(server, slice_size))
+
+      while slice_size is None:
+         connection, address = server.accept()
+         with connection:
+            try:
+               request = marshal.loads(receive_message(connection))
+               send_message(connection, marshal.dumps(run_request(request, connection)))
+            except (OSError, EOFError, ValueError, KeyError, TypeError):
+               pass
+   finally:
+      os._exit(0)
+
+# Listen on the socket and keep the given number of processes serving it
+def run_server(socket_path, jobs, slice_size):
+
+   # A socket left by a server which did not stop cleanly is replaced,
+   # anything else at the path is kept
+   try:
+      path_mode = os.lstat(socket_path).st_mode
+   except FileNotFoundError:
+      path_mode = None
+   except OSError:
+      print_error('Error: cannot access the socket path', ERR_PARAM)
+
+   if path_mode is not None:
+      if not stat.S_ISSOCK(path_mode):
+         print_error('Error: the socket path exists and is not a socket', ERR_PARAM)
+      try:
+         with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            probe.connect(socket_path)
+         print_error('Error: the server is already running', ERR_PARAM)
+      except ConnectionRefusedError:
+         os.unlink(socket_path)
+
+   # The socket is created readable only by the user, so that nobody
+   # else can connect even before it's listening
+   server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+   old_umask = os.umask(0o177)
+   try:
+      server.bind(socket_path)
+   finally:
+      os.umask(old_umask)
+   server.listen(128)
+
+   # Stop cleanly on SIGTERM too
+   signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(ERR_OK))
 
-         # nils can be compared
-         if (value_1_type == 'nil' or value_2_type == 'nil'):
+   workers = set()
+   try:
+      while True:
+         # Replace the processes which ended
+         while len(workers) < jobs:
+            pid = os.fork()
+            if pid == 0:
+               serve_connections(server, slice_size)
+            workers.add(pid)
+
+         pid, status = os.wait()
+         workers.discard(pid)
+   except KeyboardInterrupt:
+      pass
+   finally:
+      # A worker may be already waited for, when the signal came
+      # during os.wait()
+      for pid in workers:
+         try:
+            os.kill(pid, signal.SIGTERM)
+         except ProcessLookupError:
             pass
-         elif value_1_type != value_2_type:
-            print_error(f'Error: second and third argument of {opcode} must be of the same type', ERR_BAD_TYPE)
+      server.close()
+      os.unlink(socket_path)
+
+############################### SCHEDULER #################################
+
+# The scheduler runs many programs as asyncio tasks in one thread. Each
+# program runs the given number of instructions at once and then lets the
+# other programs run, a READ waits for the line without blocking them. The
+# state of the interpretation is in the module globals, so it's swapped
+# for the state of the program before each slice of instructions and back
+# after it.
+
+# Names of the globals with the state of a program
+state_names = ('instructions', 'labels', 'input_file', 'output', 'global_frame', 'local_frames', 'temporary_frame', 'local_frame_size', 'stack_values', 'stack_types', 'call_stack')
+
+# The state of a program which is not loaded yet
+def create_state(program_input, program_output):
+   return {
+      'instructions': None,
+      'labels': {},
+      'input_file': program_input,
+      'output': program_output,
+      'global_frame': ([], []),
+      'local_frames': [],
+      'temporary_frame': None,
+      'local_frame_size': 0,
+      'stack_values': [],
+      'stack_types': [],
+      'call_stack': []
+   }
+
+# Replace the current state by the given one, returns the current one
+def swap_state(state):
+   module_globals = globals()
+   current = {name: module_globals[name] for name in state_names}
+   module_globals.update(state)
+   return current
+
+# Interpret at most the given number of bound instructions from the
+# position, stops before a READ if the line is not ready, returns the
+# position of the next instruction
+def run_slice(code, i, count, line_source):
+   end = len(code)
+   while i < end and count > 0:
+      handler, args = code[i]
+      if handler is execute_read and line_source is not None and not line_source.is_ready():
+         break
+
+      next_i = handler(args, i)
+      if next_i is None:
+         i += 1
+      else:
+         i = next_i
+      count -= 1
+
+   return i
+
+# Run a program as an asyncio task with the input for READ, a LineCursor
+# or an AsyncLineSource, and the output written to the binary stream,
+# returns the exit code and the error output
+async def run_program_async(source_file, loader, program_input, stdout, slice_size=1000):
+   state = create_state(program_input, OutputWriter(stdout, 'utf-8', 'strict', 'block'))
+   stderr = io.StringIO()
+   line_source = program_input if isinstance(program_input, AsyncLineSource) else None
+   code = None
+   i = 0
+
+   # The program is loaded in it's first slice
+   def run_program():
+      global instructions
+      global labels
+      nonlocal code
+      nonlocal i
+
+      if code is None:
+         instructions = loader(source_file)
+         labels = find_labels(instructions)
+         link_labels(instructions, labels)
+         assign_slots(instructions)
+         code = prepare_code(instructions)
+
+      i = run_slice(code, i, slice_size, line_source)
+      if i >= len(code):
+         output.flush()
+         sys.exit(ERR_OK)
+
+   while True:
+      current = swap_state(state)
+      try:
+         exit_code = capture_exit(run_program, stderr)
+      finally:
+         state = swap_state(current)
+
+      if exit_code is not None:
+         return exit_code, stderr.getvalue()
 
-         # Set the value in case of different types
+      # Wait for the input of the next READ or let the other programs run
+      if line_source is not None and not line_source.is_ready():
          try:
-            if value_1_type == 'nil':
-               if value_2_type == 'nil':
-                  value = True
-               else:
-                  value = False
-            elif value_2_type == 'nil':
-               if value_1_type == 'nil':
-                  value = True
-               else:
-                  value = False
-            elif value_1_type == 'int':
-               value = bool(int(value_1) == int(value_2))
-            elif value_1_type == 'string':
-               value_1 = replace_escape_sequences(value_1)
-               value_2 = replace_escape_sequences(value_2)           
-               value = bool(value_1 == value_2)
-            else:
-               if value_1 == value_2:
-                  value = True
-               else:
-                  value = False
-         except:
-            print_error(f'Error: {opcode} - typeerror', ERR_BAD_TYPE)
-
-         # If the condition is true, jump
-         if value == True:
-            label_name = arg1.get_value()
-            if label_name in labels:
-               i = labels[label_name] # jump
-            else:
-               print_error('Error: undefined label', ERR_SEMANTIC)
-
-      elif opcode == "JUMPIFNEQ":
-         
-         arg1 = inst.get_args()[0]
-         arg2 = inst.get_args()[1]
-         arg3 = inst.get_args()[2]
-
-         # Check is label exists
-         if arg1.get_value() not in labels:
-            print_error('Error: undefined label', ERR_SEMANTIC)
-
-         # Default is false
-         value = False
-
-         # Check types and retrieve the value and type
-         if (arg1.get_type() != 'label'):
-            print_error(f'Error: first argument of {opcode} must be of type label', ERR_BAD_TYPE)
-
-         if (arg2.get_type() in ['int', 'string', 'bool', 'nil']):
-            value_1 = arg2.get_value()
-            value_1_type = arg2.get_type()
-         elif (arg2.get_type() == 'var'):
-            var2_frame, var2_name = arg2.get_value().split('@')
-            var2 = Variable(var2_name, None, var2_frame)
-            value_1 = var2.get_value()
-            value_1_type = var2.get_type()
-            
-         else:
-            print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+            await line_source.wait_line()
+         except (OSError, ValueError) as error:
+            stderr.write(f'Error: {error!r}\n')
+            return ERR_INTERNAL, stderr.getvalue()
+      else:
+         await asyncio.sleep(0)
 
-         if (arg3.get_type() in ['int', 'string', 'bool', 'nil']):
-            value_2 = arg3.get_value()
-            value_2_type = arg3.get_type()
-         elif (arg3.get_type() == 'var'):
-            var3_frame, var3_name = arg3.get_value().split('@')
-            var3 = Variable(var3_name, None, var3_frame)
-            value_2 = var3.get_value()
-            value_2_type = var3.get_type()
+# Run the programs of all connections of the process by the scheduler,
+# the standard input of the clients is read by AsyncLineSource
+async def serve_async(server, slice_size):
 
+   async def handle_connection(reader, writer):
+      try:
+         size = int.from_bytes(await reader.readexactly(8), 'big')
+         request = marshal.loads(await reader.readexactly(size))
+
+         if request['input'] is not None:
+            program_input = get_request_input(request)
          else:
-            print_error(f'Error: second and third argument of {opcode} must be of type symb', ERR_BAD_TYPE)
+            program_input = AsyncLineSource(reader, locale.getpreferredencoding(False))
 
-         # nils can be compared
-         if (value_1_type == 'nil' or value_2_type == 'nil'):
-            pass
-         elif value_1_type != value_2_type:
-            print_error(f'Error: second and third argument of {opcode} must be of the same type', ERR_BAD_TYPE)
+         stdout = io.BytesIO()
+         code, stderr = await run_program_async(io.BytesIO(request['source']), get_request_loader(request), program_input, stdout, slice_size)
 
-         # Set the value in case of different types
+         data = marshal.dumps((stdout.getvalue(), stderr.encode(), code))
+         writer.write(len(data).to_bytes(8, 'big') + data)
+         await writer.drain()
+      except (OSError, EOFError, ValueError, KeyError, TypeError):
+         pass
+      finally:
+         writer.close()
+
+   async with await asyncio.start_unix_server(handle_connection, sock=server, limit=1 << 20) as async_server:
+      await async_server.serve_forever()
+
+################################ BODY ###################################
+
+# Interpret the loaded program
+def interpret_program(program):
+   run_code(prepare_code(program))
+
+# Bind each instruction to it's handler, so that the interpretation
+# does not need to compare any opcodes
+def prepare_code(program):
+   code = bind_handlers(program)
+   return fuse_instructions(program, code)
+
+# Interpret the bound instructions, with the count and the time of each
+# instruction and of each call of a label. The instructions are not fused,
+# so each of them is counted. The report is written when the program ends,
+# even by an error.
+def run_code_profiled(program, code):
+   opcodes = [program.get_opcode(i) for i in range(len(program))]
+   counts = [0] * len(code)
+   times = [0.0] * len(code)
+
+   # For each called label the number of calls and the inclusive and
+   # exclusive time, the active calls are lists of the label, the start
+   # and the time of the nested calls
+   subroutines = {}
+   active_calls = []
+   clock = time.perf_counter
+
+   start = clock()
+   i = 0
+   end = len(code)
+   try:
+      while i < end:
+         handler, args = code[i]
+         before = clock()
+
+         # The instruction which ends the program by an error or EXIT
+         # is counted too
          try:
-            if value_1_type == 'nil':
-               if value_2_type == 'nil':
-                  value = True
-               else:
-                  value = False
-            elif value_2_type == 'nil':
-               if value_1_type == 'nil':
-                  value = True
-               else:
-                  value = False
-            elif value_1_type == 'int':
-               value = bool(int(value_1) == int(value_2))
-            elif value_1_type == 'string':
-               value_1 = replace_escape_sequences(value_1)
-               value_2 = replace_escape_sequences(value_2)           
-               value = bool(value_1 == value_2)
-            else:
-               if value_1 == value_2:
-                  value = True
-               else:
-                  value = False
-         except:
-            print_error(f'Error: {opcode} - typeerror', ERR_BAD_TYPE)
-
-         # If value is false, jump
-         if value == False:
-            label_name = arg1.get_value()
-            if label_name in labels:
-               i = labels[label_name] # jump
-            else:
-               print_error('Error: undefined label', ERR_SEMANTIC)
-
-      elif opcode == "EXIT":
-
-         arg1 = inst.get_args()[0]
-
-         # Check types and retrieve the value
-         if (arg1.get_type() == 'int'):
-            value = arg1.get_value()
-         elif (arg1.get_type() == 'var'):
-            var_frame, var_name = arg1.get_value().split('@')
-            var = Variable(var_name, None, var_frame)
-            if var.get_type() != 'int':
-               print_error(f'Error: first argument of {opcode} must be of type int', ERR_BAD_TYPE)
-            value = var.get_value()
+            next_i = handler(args, i)
+         finally:
+            after = clock()
+            counts[i] += 1
+            times[i] += after - before
+
+         if opcodes[i] == 'CALL':
+            active_calls.append([args[0].get_value(), after, 0.0])
+         elif opcodes[i] == 'RETURN' and active_calls:
+            end_call(subroutines, active_calls, after)
+
+         # Continue with the next instruction or jump
+         if next_i is None:
+            i += 1
          else:
-            print_error(f'Error: first argument of {opcode} must be of type int', ERR_BAD_TYPE)
+            i = next_i
+   finally:
+      # The calls which did not return end with the program
+      finish = clock()
+      while active_calls:
+         end_call(subroutines, active_calls, finish)
+      output.flush()
+      write_profile(program, opcodes, counts, times, subroutines, finish - start)
+
+# Add the time of the last active call to it's label, the recursive calls
+# are only added to the inclusive time of the outermost call
+def end_call(subroutines, active_calls, now):
+   label, start, nested_time = active_calls.pop()
+   elapsed = now - start
+
+   totals = subroutines.setdefault(label, [0, 0.0, 0.0])
+   totals[0] += 1
+   totals[2] += elapsed - nested_time
+   if all(call[0] != label for call in active_calls):
+      totals[1] += elapsed
+
+   if active_calls:
+      active_calls[-1][2] += elapsed
+
+# Write the report of the profile to stderr, the hottest first
+def write_profile(program, opcodes, counts, times, subroutines, total_time):
+   hot_count = 20
+   executed = sum(counts)
+
+   opcode_totals = {}
+   for i in range(len(counts)):
+      if counts[i]:
+         totals = opcode_totals.setdefault(opcodes[i], [0, 0.0])
+         totals[0] += counts[i]
+         totals[1] += times[i]
+
+   report = [f'Profile: {executed} instructions in {total_time * 1000:.2f} ms', '']
+
+   report.append(f"{'Opcode':<12}{'Count':>12}{'Time ms':>12}{'%':>8}")
+   for opcode, (count, opcode_time) in sorted(opcode_totals.items(), key=lambda item: -item[1][1]):
+      report.append(f'{opcode:<12}{count:>12}{opcode_time * 1000:>12.2f}{opcode_time * 100 / (total_time or 1):>8.1f}')
+
+   report.extend(['', f'Hot instructions (top {hot_count}):'])
+   report.append(f"{'Order':>8}  {'Opcode':<12}{'Count':>12}{'Time ms':>12}{'%':>8}")
+   hot = sorted((i for i in range(len(counts)) if counts[i]), key=lambda i: -times[i])[:hot_count]
+   for i in hot:
+      report.append(f'{program.get_order(i):>8}  {opcodes[i]:<12}{counts[i]:>12}{times[i] * 1000:>12.2f}{times[i] * 100 / (total_time or 1):>8.1f}')
+
+   if subroutines:
+      report.extend(['', 'Called labels:'])
+      report.append(f"{'Label':<20}{'Calls':>10}{'Inclusive ms':>14}{'Exclusive ms':>14}")
+      for label, (calls, inclusive, exclusive) in sorted(subroutines.items(), key=lambda item: -item[1][1]):
+         report.append(f'{label:<20}{calls:>10}{inclusive * 1000:>14.2f}{exclusive * 1000:>14.2f}')
+
+   sys.stderr.write('\n'.join(report) + '\n')
+   sys.stderr.flush()
+
+# Interpret the bound instructions
+def run_code(code):
+   i = 0
+   end = len(code)
+   while i < end:
+      handler, args = code[i]
+      next_i = handler(args, i)
+
+      # Continue with the next instruction or jump
+      if next_i is None:
+         i += 1
+      else:
+         i = next_i
 
-         # Check value range
-         if int(value) < 0 or int(value) > 49:
-            print_error(f'Error: {opcode} - invalid error value', ERR_OPERAND_VALUE) 
+   output.flush()
 
-         # Exit with the given value
-         sys.exit(int(value))        
+def main():
 
-      # Just acknowledge these and ignore them
-      elif opcode == "DPRINT":
-         pass
+   # Global variables
+   global instructions
+   global labels
+   global input_file
+   global output
+   global loaded_program
 
-      elif opcode == "BREAK":
-         pass
+   # Get the source and input file names
+   args = check_input_arguments()
 
-      # DON'T NEED TO DO THESE
-      elif opcode == "CLEARS":
-         # handle EQ instruction with 0 arguments
-         pass
-      elif opcode == "ADDS":
-         # handle AND instruction with 0 arguments
-         pass
-      elif opcode == "SUBS":
-         # handle OR instruction with 0 arguments
-         pass
-      elif opcode == "MULS":
-         # handle NOT instruction with 0 arguments
-         pass
-      elif opcode == "IDIVS":
-         # handle INT2CHAR instruction with 0 arguments
-         pass
-      elif opcode == "LTS":
-         # handle STRI2INT instruction with 0 arguments
-         pass
-      elif opcode == "GTS":
-         # handle READ instruction with 2 arguments
-         pass
-      elif opcode == "EQS":
-         # handle WRITE instruction with 1 argument
-         pass
-      elif opcode == "ANDS":
-         # handle CONCAT instruction with 0 arguments
-         pass
-      elif opcode == "ORS":
-         # handle GT instruction with 0 arguments
-         pass
-      elif opcode == "NOTS":
-         # handle EQ instruction with 0 arguments
-         pass
-      elif opcode == "INT2CHARS":
-         # handle AND instruction with 0 arguments
-         pass
-      elif opcode == "STRI2INTS":
-         # handle OR instruction with 0 arguments
-         pass
-      elif opcode == "JUMPIFEQS":
-         # handle NOT instruction with 0 arguments
-         pass
-      elif opcode == "JUMPIFNEQS":
-         # handle INT2CHAR instruction with 0 arguments
+   # Run the tests of the directory instead of a program
+   if args.batch is not None:
+      if not run_batch(args.batch, args.jobs, args.timeout):
+         sys.exit(1)
+      return
+
+   # Run the programs of the clients
+   if args.serve is not None:
+      run_server(args.serve, args.jobs, args.async_slice)
+      return
+
+   output = OutputWriter(sys.stdout.buffer, sys.stdout.encoding, sys.stdout.errors, args.flush)
+   source_name = args.source
+   input_name = args.input
+
+   # Map the input file, empty files and other than regular
+   # files cannot be mapped and are read whole
+   if input_name is not None:
+      try:
+         input_file = MappedInput(input_name)
+      except (ValueError, OSError):
+         input_file = LineCursor(open(input_name).read())
+
+   # If stdin input is needed, it's read during the interpretation,
+   # unless the source is read from stdin too
+   if input_file is None and args.inputs_from is None:
+      if args.source is None and args.source_text is None:
+         input_file = LineCursor(sys.stdin.read())
+      else:
+         input_file = InputStream(sys.stdin)
+
+   # Choose the loader based on the source format
+   if args.source_text is not None:
+      source_name = args.source_text
+      source_format = 'text'
+      loader = load_source_text
+   else:
+      source_format = 'xml'
+      loader = load_program
+
+   # Open the source file or use stdin
+   if source_name is not None:
+      try:
+         source_file = open(source_name, 'rb')
+      except OSError:
+         print_error('Error: cannot open the source file', ERR_IN_FILE)
+   else:
+      source_file = sys.stdin.buffer
+
+   # The whole source is needed for the cache and compilation keys
+   if args.cache_dir is not None or args.compile:
+      source_data = source_file.read()
+      key = get_source_key(source_data, source_format)
+      source_file.close()
+      source_file = io.BytesIO(source_data)
+
+   # The compiled program is kept in the cache directory, only when
+   # nobody else can write there, because the module is run as it is
+   compiled = None
+   compiled_path = None
+   if args.compile and not args.profile and args.cache_dir is not None:
+      try:
+         os.makedirs(args.cache_dir, mode=0o700, exist_ok=True)
+      except OSError:
          pass
-      
-      # Increment the instruction counter
-      i += 1
-      
+
+      if is_private_directory(args.cache_dir):
+         compiled_path = os.path.join(args.cache_dir, key + '.py')
+         compiled = load_compiled_program(compiled_path, key)
+
+   if args.cache_dir is not None:
+      cache = ProgramCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+   if compiled is not None:
+      # Mark the module and it's program as recently used, so that
+      # they are not the first to be evicted
+      cache.touch(compiled_path)
+      cache.touch(cache.get_path(key))
+   else:
+      if args.cache_dir is not None:
+         # Look the program up in the cache, load and store it on a miss
+         cached = cache.load(key)
+         if cached is not None:
+            instructions, labels = cached
+         else:
+            instructions = loader(source_file)
+            labels = find_labels(instructions)
+            cache.store(key, instructions, labels)
+      else:
+         # Load the program straight from the source
+         instructions = loader(source_file)
+         labels = find_labels(instructions)
+
+      # Resolve the jumps, after the labels are known
+      link_labels(instructions, labels)
+      assign_slots(instructions)
+
+      if args.compile and not args.profile and Transpiler.can_translate(instructions):
+         compiled = compile_program(instructions, labels, key, compiled_path)
+
+         # The saved module counts into the size of the cache too
+         if compiled_path is not None:
+            cache.evict()
+
+   source_file.close()
+
+   # Run the program for each of the listed inputs, it's bound before
+   # the processes are forked
+   if args.inputs_from is not None:
+      if compiled is not None:
+         loaded_program = lambda: run_compiled_program(compiled)
+      else:
+         code = prepare_code(instructions)
+         loaded_program = lambda: run_code(code)
+
+      run_inputs(args.inputs_from, args.results, args.jobs)
+      return
+
+   if compiled is not None:
+      run_compiled_program(compiled)
+      output.flush()
+      return
+
+   if args.profile:
+      run_code_profiled(instructions, bind_handlers(instructions))
+      return
+
+   interpret_program(instructions)
+
 if __name__ == '__main__':
-   main()
\ No newline at end of file
+   try:
+      main()
+   except InterpretError as error:
+      sys.stderr.write(f'{error}\n')
+      sys.exit(error.code)
\ No newline at end of file
@@ -0,0 +1,135 @@
+#
+# FIT VUT 2023 - IPP Project Implemenation part 2
+# Client of the interpret server of IPPcode23 language
+#
+# File: interpret_client.py
+# Author(s): xpauli08
+#
+
+# Sends the program and it's input to the server started by
+# 'interpret.py --serve SOCKET', the socket is given by the INTERPRET_SOCKET
+# environment variable. The arguments are the same as of interpret.py,
+# the output, error output and exit code are the ones of the program.
+# Without the server, with other arguments or when a file cannot be read,
+# interpret.py is run instead, so it reports the errors the same way.
+
+import sys
+import os
+import socket
+import marshal
+import threading
+
+ERR_INTERNAL = 99
+
+# Arguments handled by the server
+client_arguments = ('--source', '--source-text', '--input')
+
+# Returns the dict of the arguments, None if they need interpret.py
+def parse_arguments(argv):
+   options = {}
+
+   i = 0
+   while i < len(argv):
+      name, separator, value = argv[i].partition('=')
+      if name not in client_arguments or name in options:
+         return None
+
+      if not separator:
+         i += 1
+         if i == len(argv):
+            return None
+         value = argv[i]
+
+      options[name] = value
+      i += 1
+
+   # The same combinations as checked by interpret.py
+   if not options or ('--source' in options and '--source-text' in options):
+      return None
+
+   return options
+
+# Replace this process by interpret.py with the same arguments
+def run_interpret():
+   interpret_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'interpret.py')
+   os.execv(sys.executable, [sys.executable, interpret_path] + sys.argv[1:])
+
+def read_file(name):
+   try:
+      with open(name, 'rb') as data_file:
+         return data_file.read()
+   except OSError:
+      run_interpret()
+
+# Send the standard input after the request, while the program runs, the
+# file descriptor is read directly, so the exit does not wait for it
+def send_input(connection):
+   try:
+      while True:
+         data = os.read(sys.stdin.fileno(), 65536)
+         if not data:
+            break
+         connection.sendall(data)
+      connection.shutdown(socket.SHUT_WR)
+   except OSError:
+      pass
+
+# Receive exactly the given number of bytes
+def receive_bytes(connection, size):
+   chunks = []
+   while size > 0:
+      chunk = connection.recv(min(size, 1 << 20))
+      if not chunk:
+         raise EOFError('connection closed')
+      chunks.append(chunk)
+      size -= len(chunk)
+
+   return b''.join(chunks)
+
+def main():
+   options = parse_arguments(sys.argv[1:])
+   socket_path = os.environ.get('INTERPRET_SOCKET')
+   if options is None or not socket_path or not hasattr(socket, 'AF_UNIX'):
+      run_interpret()
+
+   connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+   try:
+      connection.connect(socket_path)
+   except OSError:
+      run_interpret()
+
+   # The files are read before the standard input, so interpret.py
+   # can still be run if they cannot be read
+   source_format = 'text' if '--source-text' in options else 'xml'
+   source_name = options.get('--source-text', options.get('--source'))
+   source = read_file(source_name) if source_name is not None else None
+   input_data = read_file(options['--input']) if '--input' in options else None
+
+   if source is None:
+      source = sys.stdin.buffer.read()
+   request = {'source': source, 'format': source_format, 'input': input_data}
+
+   # The message is it's length in 8 bytes and the marshal data, without
+   # an input file the standard input follows
+   try:
+      data = marshal.dumps(request)
+      connection.sendall(len(data).to_bytes(8, 'big') + data)
+      if input_data is None:
+         threading.Thread(target=send_input, args=(connection,), daemon=True).start()
+
+      size = int.from_bytes(receive_bytes(connection, 8), 'big')
+      stdout, stderr, code = marshal.loads(receive_bytes(connection, size))
+   except (OSError, EOFError, ValueError):
+      sys.stderr.write('Error: the interpret server did not respond\n')
+      sys.exit(ERR_INTERNAL)
+   finally:
+      connection.close()
+
+   sys.stdout.buffer.write(stdout)
+   sys.stdout.buffer.flush()
+   sys.stderr.buffer.write(stderr)
+   sys.stderr.buffer.flush()
+   sys.exit(code)
+
+if __name__ == '__main__':
+   main()
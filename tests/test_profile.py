@@ -0,0 +1,51 @@
+#
+# FIT VUT 2023 - IPP Project Implemenation part 2
+# Tests of the --profile argument of the interpret
+#
+# File: tests/test_profile.py
+# Author(s): xpauli08
+#
+
+import os
+import sys
+import subprocess
+import tempfile
+import unittest
+
+INTERPRET_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'interpret.py')
+
+class ProfileTest(unittest.TestCase):
+
+   # Run the IPPcode23 source with --profile, returns the exit code and
+   # the number of instructions of the report
+   def run_profiled(self, source):
+      with tempfile.TemporaryDirectory() as directory:
+         source_name = os.path.join(directory, 'program.ipp')
+         with open(source_name, 'w') as source_file:
+            source_file.write(source)
+
+         result = subprocess.run([sys.executable, INTERPRET_PATH, '--source-text', source_name, '--input', os.devnull, '--profile'],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+      first_line = result.stderr.split('\n')[0].split()
+      self.assertEqual(first_line[0], 'Profile:')
+      return result.returncode, int(first_line[1])
+
+   def test_end(self):
+      code, instructions = self.run_profiled('.IPPcode23\nDEFVAR GF@a\nMOVE GF@a int@1\nWRITE GF@a\n')
+      self.assertEqual((code, instructions), (0, 3))
+
+   def test_exit(self):
+      code, instructions = self.run_profiled('.IPPcode23\nDEFVAR GF@a\nMOVE GF@a int@1\nEXIT int@7\nWRITE GF@a\n')
+      self.assertEqual((code, instructions), (7, 3))
+
+   def test_error(self):
+      code, instructions = self.run_profiled('.IPPcode23\nDEFVAR GF@a\nMOVE GF@a int@1\nIDIV GF@a GF@a int@0\nWRITE GF@a\n')
+      self.assertEqual((code, instructions), (57, 3))
+
+   def test_return_error(self):
+      code, instructions = self.run_profiled('.IPPcode23\nCALL f\nLABEL f\nRETURN\nRETURN\n')
+      self.assertEqual((code, instructions), (56, 4))
+
+if __name__ == '__main__':
+   unittest.main()